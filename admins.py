@@ -0,0 +1,61 @@
+import logging
+
+from telegram import BotCommand, BotCommandScopeChat
+from telegram.ext import filters
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Commands for the admins (includes all commands)
+ADMIN_COMMANDS = [
+    BotCommand("start", "Запустить/перезапустить бота"),
+    BotCommand("deposit", "Создать депозит (только для менеджеров)"),
+    BotCommand("withdrawal", "Обработать вывод (только для менеджеров)"),
+    BotCommand("addmanager", "Добавить менеджера"),
+    BotCommand("delmanager", "Удалить менеджера"),
+    BotCommand("listmanagers", "Показать список менеджеров"),
+    BotCommand("reloadconfig", "Перечитать список администраторов"),
+    BotCommand("stats", "Состояние очереди и нагрузки на 1win"),
+    BotCommand("profile", "Снять профиль производительности"),
+    BotCommand("backup", "Резервная копия базы данных"),
+]
+
+
+# Shared by every admin-only handler; reload_admins() updates its user_ids in place
+admin_filter = filters.User(user_id=config.ADMIN_IDS)
+
+
+async def set_admin_commands(bot, admin_ids):
+    """Shows the admin command list to each of the given admins."""
+    for admin_id in admin_ids:
+        try:
+            await bot.set_my_commands(
+                ADMIN_COMMANDS, scope=BotCommandScopeChat(chat_id=admin_id)
+            )
+        except Exception as e:
+            logger.error(f"Could not set commands for admin {admin_id}: {e}")
+
+
+async def reload_admins(bot):
+    """
+    Re-reads the admin list and applies it in place.
+    Returns the (added, removed) admin IDs; raises if the file is invalid,
+    in which case the current admins stay in effect.
+    """
+    new_ids = config.load_admin_ids()
+    old_ids = config.ADMIN_IDS
+    config.ADMIN_IDS = new_ids
+    admin_filter.user_ids = new_ids
+
+    added = new_ids - old_ids
+    removed = old_ids - new_ids
+    logger.info(f"Admins reloaded: {len(new_ids)} total, added {sorted(added)}, removed {sorted(removed)}")
+
+    await set_admin_commands(bot, added)
+    for admin_id in removed:
+        try:
+            await bot.delete_my_commands(scope=BotCommandScopeChat(chat_id=admin_id))
+        except Exception as e:
+            logger.error(f"Could not reset commands for former admin {admin_id}: {e}")
+    return added, removed
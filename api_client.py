@@ -3,12 +3,47 @@ import asyncio
 import logging
 from typing import Dict, Any, Optional
 
+import config
+import tracing
+
 logger = logging.getLogger(__name__)
 
+# Statuses proving 1win did not execute the request, so it is safe to resend.
+# Timeouts, dropped connections and 5xx prove nothing: the deposit or
+# withdrawal may have gone through, and resending could duplicate it.
+RETRYABLE_STATUSES = {429}
+
+
+def is_transient_failure(result: Dict[str, Any]) -> bool:
+    """Whether a failed create_deposit/process_withdrawal certainly wasn't executed and may be retried."""
+    return not result["success"] and (result.get("not_sent", False) or result.get("status") in RETRYABLE_STATUSES)
+
+
+def is_uncertain_failure(result: Dict[str, Any]) -> bool:
+    """
+    Whether 1win may have executed a call despite the failure. Only a 4xx
+    answer is a definite rejection; timeouts, network errors, 5xx and a 2xx
+    whose body can't be read all leave the outcome unknown.
+    """
+    status = result.get("status")
+    definite = status is not None and 400 <= status < 500
+    return not result["success"] and not is_transient_failure(result) and not definite
+
+# 400 errors recognised by phrase, checked before the generic amount limit (400-01)
+SPECIFIC_400_ERRORS = [
+    ('withdrawal amount exceeds available cash balance', '400-06'),
+    ('invalid cash desk identifier', '400-07'),
+    ('deposit already created', '400-02'),
+    ('fee is too high', '400-03'),
+    ('withdrawal is being processed', '400-04'),
+    ('incorrect code', '400-05'),
+]
+
+
 class WinAPIClient:
     """Client for interacting with the 1win API."""
     
-    BASE_URL = "https://api.1win.win/v1/client"
+    BASE_URL = config.API_BASE_URL
     
     def __init__(self, api_key: str):
         self.api_key = api_key
@@ -21,6 +56,15 @@ class WinAPIClient:
         """Make an HTTP request to the API."""
         url = f"{self.BASE_URL}/{endpoint}"
         
+        with tracing.span("winapi.request", method=method, endpoint=endpoint) as span:
+            result = await self._send(method, url, data)
+            if span is not None:
+                span["attrs"]["success"] = result["success"]
+                span["attrs"]["status"] = result.get("status")
+            return result
+
+    async def _send(self, method: str, url: str, data: Optional[Dict]) -> Dict[str, Any]:
+        """Perform the HTTP round trip and normalize the response."""
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.request(
@@ -52,6 +96,10 @@ class WinAPIClient:
                             "status": response.status
                         }
         
+        except aiohttp.ClientConnectorError as e:
+            # The connection was never established, so nothing reached 1win
+            logger.error(f"HTTP connection failed: {e}")
+            return {"success": False, "error": f"Connection failed: {str(e)}", "not_sent": True}
         except aiohttp.ClientError as e:
             logger.error(f"HTTP request failed: {e}")
             return {"success": False, "error": f"Network error: {str(e)}"}
@@ -62,14 +110,56 @@ class WinAPIClient:
             logger.error(f"Unexpected error: {e}")
             return {"success": False, "error": f"Unexpected error: {str(e)}"}
     
-    def _parse_error_message(self, error_data: dict, status: int) -> str:
-        """Parse specific error codes from the API with user-friendly Russian descriptions."""
+    def _error_code(self, error_data: dict, status: int) -> str:
+        """
+        Classify an API error into the codes shown to managers, e.g. '400-01'.
+
+        Specific phrases are matched before the generic amount/limit check,
+        since some of them also contain "amount exceeds":
+
+        >>> client = WinAPIClient("key")
+        >>> client._error_code({"errorMessage": "Withdrawal amount exceeds available cash balance"}, 400)
+        '400-06'
+        >>> client._error_code({"errorMessage": "Invalid cash desk identifier"}, 400)
+        '400-07'
+        >>> client._error_code({"errorMessage": "Deposit already created"}, 400)
+        '400-02'
+        >>> client._error_code({"errorMessage": "Amount exceeds limit"}, 400)
+        '400-01'
+        >>> client._error_code("Network error", 400)
+        '400-00'
+        """
+        # Network errors and unparseable bodies arrive as plain strings
+        if not isinstance(error_data, dict):
+            error_data = {'errorMessage': str(error_data)}
         error_code = error_data.get('errorCode', '')
         error_message = error_data.get('errorMessage', '')
         
-        # Handle specific error codes with intuitive Russian explanations
         if status == 400:
+            for phrase, code in SPECIFIC_400_ERRORS:
+                if phrase in error_message.lower():
+                    return code
             if 'amount exceeds' in error_message.lower() or 'limit' in error_message.lower():
+                return '400-01'
+            return '400-00'
+        elif status == 404:
+            if error_code == 'CASH02' or 'withdrawal not found' in error_message.lower():
+                return '404-01'
+            return '404-02'
+        elif status == 429:
+            if error_code == 'CASH06' or 'TooManyRequests' in error_message:
+                return '429-01'
+            return '429-02'
+        return str(status)
+    
+    def _parse_error_message(self, error_data: dict, status: int) -> str:
+        """Parse specific error codes from the API with user-friendly Russian descriptions."""
+        code = self._error_code(error_data, status)
+        error_message = error_data.get('errorMessage', '') if isinstance(error_data, dict) else str(error_data)
+        
+        # Handle specific error codes with intuitive Russian explanations
+        if status == 400:
+            if code == '400-01':
                 return (
                     "❌ **Ошибка #400-01: Проблема с суммой депозита**\n\n"
                     "🔍 **Возможные причины:**\n"
@@ -81,7 +171,7 @@ class WinAPIClient:
                     "• Уточните у пользователя его лимиты\n"
                     "• Обратитесь к администратору, если проблема повторяется"
                 )
-            elif 'deposit already created' in error_message.lower():
+            elif code == '400-02':
                 return (
                     "❌ **Ошибка #400-02: Депозит уже создан**\n\n"
                     "ℹ️ У этого пользователя уже есть активный депозит.\n\n"
@@ -90,7 +180,7 @@ class WinAPIClient:
                     "• Проверьте статус депозита пользователя\n"
                     "• Если депозит завис, обратитесь к администратору"
                 )
-            elif 'fee is too high' in error_message.lower():
+            elif code == '400-03':
                 return (
                     "❌ **Ошибка #400-03: Комиссия слишком высокая**\n\n"
                     "ℹ️ Комиссия за этот депозит превышает допустимые пределы.\n\n"
@@ -98,7 +188,7 @@ class WinAPIClient:
                     "• Попробуйте меньшую сумму\n"
                     "• Обратитесь к администратору для настройки комиссии"
                 )
-            elif 'withdrawal is being processed' in error_message.lower():
+            elif code == '400-04':
                 return (
                     "❌ **Ошибка #400-04: Вывод уже обрабатывается**\n\n"
                     "ℹ️ У этого пользователя уже есть активный запрос на вывод.\n\n"
@@ -107,7 +197,7 @@ class WinAPIClient:
                     "• Проверьте статус вывода пользователя\n"
                     "• Если вывод завис, обратитесь к администратору"
                 )
-            elif 'incorrect code' in error_message.lower():
+            elif code == '400-05':
                 return (
                     "❌ **Ошибка #400-05: Неверный код подтверждения**\n\n"
                     "ℹ️ Код, который ввел пользователь, не подходит.\n\n"
@@ -116,7 +206,7 @@ class WinAPIClient:
                     "• Убедитесь, что код не истек\n"
                     "• Попросите пользователя получить новый код"
                 )
-            elif 'withdrawal amount exceeds available cash balance' in error_message.lower():
+            elif code == '400-06':
                 return (
                     "❌ **Ошибка #400-06: Недостаточно средств в кассе**\n\n"
                     "ℹ️ В кассе нет достаточной суммы для выплаты.\n\n"
@@ -125,7 +215,7 @@ class WinAPIClient:
                     "• Предложите пользователю вывести меньшую сумму\n"
                     "• Дождитесь пополнения баланса кассы"
                 )
-            elif 'invalid cash desk identifier' in error_message.lower():
+            elif code == '400-07':
                 return (
                     "❌ **Ошибка #400-07: Проблема с кассой**\n\n"
                     "ℹ️ Идентификатор кассы неверный или касса недоступна.\n\n"
@@ -155,7 +245,7 @@ class WinAPIClient:
             )
         
         elif status == 404:
-            if error_code == 'CASH02' or 'withdrawal not found' in error_message.lower():
+            if code == '404-01':
                 return (
                     "❌ **Ошибка #404-01: Запрос на вывод не найден**\n\n"
                     "ℹ️ У пользователя нет активного запроса на вывод.\n\n"
@@ -175,7 +265,7 @@ class WinAPIClient:
                 )
         
         elif status == 429:
-            if error_code == 'CASH06' or 'TooManyRequests' in error_message:
+            if code == '429-01':
                 return (
                     "❌ **Ошибка #429-01: Слишком много запросов**\n\n"
                     "ℹ️ Система временно ограничила количество запросов.\n\n"
@@ -222,8 +312,14 @@ class WinAPIClient:
         result = await self._make_request("POST", "deposit", data)
         
         if not result["success"]:
-            error_message = self._parse_error_message(result.get("error", {}), result.get("status", 0))
-            return {"success": False, "message": error_message}
+            error_data, status = result.get("error", {}), result.get("status", 0)
+            return {
+                "success": False,
+                "message": self._parse_error_message(error_data, status),
+                "status": result.get("status"),
+                "error_code": self._error_code(error_data, status),
+                "not_sent": result.get("not_sent", False),
+            }
         
         # Success case
         deposit_data = result["data"]
@@ -246,8 +342,14 @@ class WinAPIClient:
         result = await self._make_request("POST", "withdrawal", data)
         
         if not result["success"]:
-            error_message = self._parse_error_message(result.get("error", {}), result.get("status", 0))
-            return {"success": False, "message": error_message}
+            error_data, status = result.get("error", {}), result.get("status", 0)
+            return {
+                "success": False,
+                "message": self._parse_error_message(error_data, status),
+                "status": result.get("status"),
+                "error_code": self._error_code(error_data, status),
+                "not_sent": result.get("not_sent", False),
+            }
         
         # Success case
         withdrawal_data = result["data"]
@@ -1,3 +1,4 @@
+import json
 import os
 
 TOKEN = os.environ.get("BOT_TOKEN", "7312413389:AAH1djA4FKjIGJwXMWmyOHORT5qckScq52U")
@@ -5,7 +6,7 @@ TOKEN = os.environ.get("BOT_TOKEN", "7312413389:AAH1djA4FKjIGJwXMWmyOHORT5qckScq
 # --- Multi-Admin Configuration ---
 
 # A list of admin user IDs that can be changed directly in the code.
-ADMIN_IDS = [
+DEFAULT_ADMIN_IDS = [
     6965346393,
     7586007738,  # The test ID you wanted to add
     788357726    # osimijasur - add this user as admin
@@ -18,12 +19,173 @@ primary_admin_id_str = os.environ.get("ADMIN_ID")
 if primary_admin_id_str:
     try:
         primary_admin_id = int(primary_admin_id_str)
-        if primary_admin_id not in ADMIN_IDS:
-            ADMIN_IDS.append(primary_admin_id)
+        if primary_admin_id not in DEFAULT_ADMIN_IDS:
+            DEFAULT_ADMIN_IDS.append(primary_admin_id)
     except ValueError:
         # Handle case where ADMIN_ID is not a valid integer
         print(f"Warning: ADMIN_ID environment variable ('{primary_admin_id_str}') is not a valid integer.")
 
+# Extra admins can be listed in a JSON file, {"admin_ids": [123, 456]}.
+# The file is re-read on SIGHUP or /reloadconfig, without a restart.
+ADMINS_FILE = os.environ.get("ADMINS_FILE", "admins.json")
+
+
+def read_admins_file():
+    """Returns the admin IDs listed in ADMINS_FILE (empty if the file doesn't exist)."""
+    if not os.path.exists(ADMINS_FILE):
+        return []
+    with open(ADMINS_FILE, encoding="utf-8") as f:
+        data = json.load(f)
+    return [int(admin_id) for admin_id in data.get("admin_ids", [])]
+
+
+def load_admin_ids():
+    """Combines the built-in admins with ADMINS_FILE. Raises if the file is invalid."""
+    return frozenset(DEFAULT_ADMIN_IDS) | frozenset(read_admins_file())
+
+
+# Current admins. Replaced as a whole on reload, never mutated in place.
+try:
+    ADMIN_IDS = load_admin_ids()
+except (OSError, ValueError, AttributeError, TypeError) as e:
+    print(f"Warning: could not read {ADMINS_FILE} ({e}), using built-in admins only.")
+    ADMIN_IDS = frozenset(DEFAULT_ADMIN_IDS)
+
 # --- API Configuration ---
-# Single API key shared by all managers
+# Endpoints can be overridden, e.g. to point the bot at the local fakes in loadtest.py
+TELEGRAM_BASE_URL = os.environ.get("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
+API_BASE_URL = os.environ.get("API_BASE_URL", "https://api.1win.win/v1/client")
+
+# Default API key, used when no key pool is configured
 API_KEY = os.environ.get("API_KEY", "2d329336c2f4c0612b96ce032ed081dec1ce0ee9805182f6a7f047e220ab06cb")
+
+# Optional pool of API keys, each bound to a cash desk, as
+# "key1:desk1,key2:desk2" (the desk part may be omitted).
+# Requests are spread across the pool, see key_pool.py.
+API_KEYS = []
+for entry in os.environ.get("API_KEYS", "").split(","):
+    entry = entry.strip()
+    if entry:
+        api_key, _, cash_desk = entry.partition(":")
+        API_KEYS.append((api_key.strip(), cash_desk.strip() or None))
+if not API_KEYS:
+    API_KEYS.append((API_KEY, None))
+
+# "least_outstanding" or "affinity" (each manager sticks to one key) for
+# deposits; withdrawals always stick to the manager's desk
+KEY_POOL_STRATEGY = os.environ.get("KEY_POOL_STRATEGY", "least_outstanding")
+# How long a key stays out of rotation after a 403 / 429 response
+KEY_COOLDOWN_FORBIDDEN_SECONDS = float(os.environ.get("KEY_COOLDOWN_FORBIDDEN_SECONDS", "600"))
+KEY_COOLDOWN_RATE_LIMITED_SECONDS = float(os.environ.get("KEY_COOLDOWN_RATE_LIMITED_SECONDS", "60"))
+# ... and after its cash desk is reported invalid or unavailable (400-07)
+KEY_COOLDOWN_INVALID_DESK_SECONDS = float(os.environ.get("KEY_COOLDOWN_INVALID_DESK_SECONDS", "600"))
+
+# --- Tracing Configuration ---
+# Per-update spans are written as JSON lines to a rotating local file.
+# TRACE_SAMPLE_RATE is the fraction of updates kept (0 disables sampling);
+# any update slower than TRACE_SLOW_MS is kept regardless (0 disables).
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "2000"))
+TRACE_MAX_BYTES = int(os.environ.get("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.environ.get("TRACE_BACKUP_COUNT", "5"))
+
+# --- Job Queue Configuration ---
+# Deposits and withdrawals are persisted to the 'jobs' table and processed
+# by a pool of async workers, so they survive restarts and 1win outages.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "16"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.environ.get("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.environ.get("JOB_RETRY_MAX_SECONDS", "300"))
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# On shutdown, in-flight 1win calls get this long to finish before being interrupted
+JOB_STOP_GRACE_SECONDS = float(os.environ.get("JOB_STOP_GRACE_SECONDS", "25"))
+
+# --- Fair-Share Scheduling of 1win Calls ---
+# At most SCHEDULER_MAX_CONCURRENCY 1win requests run at once; managers share
+# that capacity by weight, each with its own in-flight limit.
+# Per-manager overrides are given as "alice=2,bob=0.5".
+def parse_manager_mapping(value, cast):
+    mapping = {}
+    for entry in value.split(","):
+        name, sep, setting = entry.partition("=")
+        if sep:
+            try:
+                mapping[name.strip().lstrip("@")] = cast(setting)
+            except ValueError:
+                print(f"Warning: ignoring invalid manager setting '{entry}'.")
+    return mapping
+
+
+SCHEDULER_MAX_CONCURRENCY = int(os.environ.get("SCHEDULER_MAX_CONCURRENCY", "8"))
+MANAGER_DEFAULT_WEIGHT = float(os.environ.get("MANAGER_DEFAULT_WEIGHT", "1"))
+MANAGER_DEFAULT_MAX_IN_FLIGHT = int(os.environ.get("MANAGER_DEFAULT_MAX_IN_FLIGHT", "2"))
+MANAGER_WEIGHTS = parse_manager_mapping(os.environ.get("MANAGER_WEIGHTS", ""), float)
+MANAGER_MAX_IN_FLIGHT = parse_manager_mapping(os.environ.get("MANAGER_MAX_IN_FLIGHT", ""), int)
+# Jobs a single manager may hold in the workers at once, so one burst can't
+# occupy every worker while other managers' jobs sit in the table. Of those,
+# up to the manager's in-flight limit call 1win and the rest wait in the
+# scheduler, so this must be at least every in-flight limit. By default it
+# is twice the largest one; a smaller explicit value caps those limits.
+JOB_MAX_RUNNING_PER_MANAGER = int(os.environ.get("JOB_MAX_RUNNING_PER_MANAGER", "0")) or 2 * max(
+    [MANAGER_DEFAULT_MAX_IN_FLIGHT, *MANAGER_MAX_IN_FLIGHT.values()]
+)
+
+# --- Profiling ---
+# Limits for the admin /profile command
+PROFILE_MAX_SECONDS = int(os.environ.get("PROFILE_MAX_SECONDS", "120"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "10"))
+
+# --- Event Loop Watchdog ---
+# Loop lag is sampled every LOOP_WATCHDOG_INTERVAL_MS; a stall longer than
+# LOOP_STALL_THRESHOLD_MS is logged with the stack of the blocking code.
+LOOP_WATCHDOG_INTERVAL_MS = float(os.environ.get("LOOP_WATCHDOG_INTERVAL_MS", "100"))
+LOOP_STALL_THRESHOLD_MS = float(os.environ.get("LOOP_STALL_THRESHOLD_MS", "500"))
+
+# --- Manager List ---
+# Managers shown per /listmanagers page
+MANAGERS_PAGE_SIZE = int(os.environ.get("MANAGERS_PAGE_SIZE", "20"))
+
+# --- Deposit Pre-Flight Limits ---
+# Deposits that are certain to fail are rejected locally, see limits.py.
+DEPOSIT_MIN_AMOUNT = float(os.environ.get("DEPOSIT_MIN_AMOUNT", "0"))
+DEPOSIT_MAX_AMOUNT = float(os.environ.get("DEPOSIT_MAX_AMOUNT", "1000000"))
+# A 1win user can't get a new deposit this soon after a successful one
+DEPOSIT_COOLDOWN_SECONDS = float(os.environ.get("DEPOSIT_COOLDOWN_SECONDS", "60"))
+# Sliding-window quotas per 1win user and per manager (0 disables)
+LIMIT_WINDOW_SECONDS = float(os.environ.get("LIMIT_WINDOW_SECONDS", "600"))
+USER_DEPOSITS_PER_WINDOW = int(os.environ.get("USER_DEPOSITS_PER_WINDOW", "0"))
+MANAGER_DEPOSITS_PER_WINDOW = int(os.environ.get("MANAGER_DEPOSITS_PER_WINDOW", "0"))
+# How long amount limits learned from 400-01 responses are trusted
+LIMIT_LEARN_TTL_SECONDS = float(os.environ.get("LIMIT_LEARN_TTL_SECONDS", "86400"))
+
+# --- Database Backups ---
+# Online snapshots of the database, taken on the JobQueue every
+# BACKUP_INTERVAL_SECONDS (0 disables) and kept as gzip files in BACKUP_DIR.
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "backups")
+BACKUP_INTERVAL_SECONDS = float(os.environ.get("BACKUP_INTERVAL_SECONDS", "3600"))
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", "24"))
+
+# --- Outbound Telegram Messages ---
+# Everything sent to chats goes through outbound.OutboundQueue, which keeps
+# within Telegram's limits: ~30 messages/s overall, ~1/s per private chat
+# (with a small burst) and 20/min per group.
+SEND_GLOBAL_PER_SECOND = float(os.environ.get("SEND_GLOBAL_PER_SECOND", "30"))
+SEND_CHAT_PER_SECOND = float(os.environ.get("SEND_CHAT_PER_SECOND", "1"))
+SEND_GROUP_PER_MINUTE = float(os.environ.get("SEND_GROUP_PER_MINUTE", "20"))
+SEND_CHAT_BURST = float(os.environ.get("SEND_CHAT_BURST", "3"))
+SEND_MAX_RETRIES = int(os.environ.get("SEND_MAX_RETRIES", "3"))
+SEND_MAX_TRACKED_CHATS = int(os.environ.get("SEND_MAX_TRACKED_CHATS", "10000"))
+# HTTP connections for Bot API calls (getUpdates has its own)
+TELEGRAM_POOL_SIZE = int(os.environ.get("TELEGRAM_POOL_SIZE", "32"))
+TELEGRAM_POOL_TIMEOUT = float(os.environ.get("TELEGRAM_POOL_TIMEOUT", "10"))
+
+# --- Presence-Aware Routing ---
+# Users are routed only to managers active within PRESENCE_ONLINE_WINDOW_SECONDS
+# (falling back to the most recently active one). Activity is batched to the
+# database every PRESENCE_FLUSH_SECONDS, and assignment counts are multiplied by
+# PRESENCE_DECAY_FACTOR every PRESENCE_DECAY_INTERVAL_SECONDS.
+PRESENCE_ONLINE_WINDOW_SECONDS = float(os.environ.get("PRESENCE_ONLINE_WINDOW_SECONDS", "900"))
+PRESENCE_FLUSH_SECONDS = float(os.environ.get("PRESENCE_FLUSH_SECONDS", "60"))
+PRESENCE_DECAY_INTERVAL_SECONDS = float(os.environ.get("PRESENCE_DECAY_INTERVAL_SECONDS", "86400"))
+PRESENCE_DECAY_FACTOR = float(os.environ.get("PRESENCE_DECAY_FACTOR", "0.5"))
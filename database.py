@@ -1,7 +1,9 @@
+import os
 import sqlite3
 import threading
+import time
 
-DATABASE_FILE = "bot_database.db"
+DATABASE_FILE = os.environ.get("DATABASE_FILE", "bot_database.db")
 
 # Thread-local data to ensure thread safety for database connections
 local = threading.local()
@@ -24,6 +26,9 @@ def init_db():
     """Initializes the database and creates the 'managers' table if it doesn't exist."""
     db = get_db()
     cursor = db.cursor()
+
+    # WAL lets backups and other readers run without blocking writes
+    cursor.execute("PRAGMA journal_mode=WAL")
     
     # Create the managers table - simplified version
     cursor.execute(
@@ -35,6 +40,46 @@ def init_db():
         )
         """
     )
+
+    # Added after the first release: when the manager was last active (see presence.py)
+    columns = [row["name"] for row in cursor.execute("PRAGMA table_info(managers)")]
+    if "last_seen" not in columns:
+        cursor.execute("ALTER TABLE managers ADD COLUMN last_seen REAL")
+
+    # Durable queue of 1win operations, processed by the workers in operations.py
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            manager TEXT,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER,
+            trace_id TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            available_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            result TEXT
+        )
+        """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs (status, available_at)"
+    )
+
+    # Which manager each user was sent to, so they keep talking to the same one
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS manager_assignments (
+            user_id INTEGER PRIMARY KEY,
+            manager TEXT NOT NULL,
+            assigned_at REAL NOT NULL
+        )
+        """
+    )
     
     db.commit()
 
@@ -65,6 +110,31 @@ def get_all_managers():
     cursor.execute("SELECT username FROM managers ORDER BY id")
     return [row["username"] for row in cursor.fetchall()]
 
+def get_managers_page(after_id=None, before_id=None, limit=20):
+    """
+    Returns one page of managers (id, username, assignment_count) ordered by id,
+    using keyset pagination on the primary key: the page starts right after
+    after_id, or ends right before before_id. One extra row is fetched so the
+    caller can tell whether more managers exist in the direction of travel.
+    Returns (rows, has_more).
+    """
+    db = get_db()
+    cursor = db.cursor()
+    if before_id is not None:
+        cursor.execute(
+            "SELECT id, username, assignment_count FROM managers WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id, limit + 1),
+        )
+        rows = cursor.fetchall()
+        return list(reversed(rows[:limit])), len(rows) > limit
+
+    cursor.execute(
+        "SELECT id, username, assignment_count FROM managers WHERE id > ? ORDER BY id ASC LIMIT ?",
+        (after_id or 0, limit + 1),
+    )
+    rows = cursor.fetchall()
+    return rows[:limit], len(rows) > limit
+
 def get_next_manager():
     """
     Retrieves the next manager for assignment using round-robin logic.
@@ -88,4 +158,188 @@ def get_next_manager():
         db.commit()
         return manager["username"]
 
-    return None 
\ No newline at end of file
+    return None
+
+
+def get_manager_presence():
+    """Returns (username, assignment_count, last_seen) for every manager."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT username, assignment_count, last_seen FROM managers")
+    return cursor.fetchall()
+
+def get_manager_assignments():
+    """Returns a {user_id: manager username} mapping of remembered assignments."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT user_id, manager FROM manager_assignments")
+    return {row["user_id"]: row["manager"] for row in cursor.fetchall()}
+
+def save_manager_presence(last_seen, assignments, user_managers):
+    """
+    Persists a batch of presence updates in one transaction.
+    last_seen maps username -> timestamp; assignments maps username -> number
+    of users routed to that manager since the previous save; user_managers
+    maps user_id -> the manager that user was (re)assigned to.
+    """
+    db = get_db()
+    db.executemany(
+        "UPDATE managers SET last_seen = MAX(COALESCE(last_seen, 0), ?) WHERE username = ?",
+        [(seen, username) for username, seen in last_seen.items()],
+    )
+    db.executemany(
+        "UPDATE managers SET assignment_count = assignment_count + ? WHERE username = ?",
+        [(count, username) for username, count in assignments.items()],
+    )
+    now = time.time()
+    db.executemany(
+        "INSERT OR REPLACE INTO manager_assignments (user_id, manager, assigned_at) VALUES (?, ?, ?)",
+        [(user_id, manager, now) for user_id, manager in user_managers.items()],
+    )
+    db.commit()
+
+def decay_assignment_counts(factor):
+    """Scales every manager's assignment_count by factor, so old assignments weigh less."""
+    db = get_db()
+    db.execute("UPDATE managers SET assignment_count = CAST(assignment_count * ? AS INTEGER)", (factor,))
+    db.commit()
+
+
+# --- Job Queue ---
+
+def enqueue_job(kind, payload, manager, chat_id, message_id=None, trace_id=None):
+    """Stores a new pending job and returns its id. payload is a JSON string."""
+    db = get_db()
+    now = time.time()
+    cursor = db.cursor()
+    cursor.execute(
+        """
+        INSERT INTO jobs (kind, payload, manager, chat_id, message_id, trace_id,
+                          available_at, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (kind, payload, manager, chat_id, message_id, trace_id, now, now, now),
+    )
+    db.commit()
+    return cursor.lastrowid
+
+def claim_job(max_running_per_manager=None):
+    """
+    Marks the oldest due pending job as running and returns it, or None.
+    Jobs of managers that already have max_running_per_manager running jobs
+    are skipped, so one manager's backlog can't take every worker.
+    All workers share the event loop thread, so select-then-update is atomic
+    from their point of view; the status guard protects against anything else.
+    """
+    db = get_db()
+    now = time.time()
+    cursor = db.cursor()
+    cursor.execute(
+        """
+        SELECT * FROM jobs
+        WHERE status = 'pending' AND available_at <= ?
+          AND (? IS NULL OR manager IS NULL OR manager NOT IN (
+              SELECT manager FROM jobs
+              WHERE status = 'running' AND manager IS NOT NULL
+              GROUP BY manager HAVING COUNT(*) >= ?
+          ))
+        ORDER BY available_at ASC, id ASC LIMIT 1
+        """,
+        (now, max_running_per_manager, max_running_per_manager),
+    )
+    job = cursor.fetchone()
+    if job is None:
+        return None
+
+    cursor.execute(
+        """
+        UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?
+        WHERE id = ? AND status = 'pending'
+        """,
+        (now, job["id"]),
+    )
+    db.commit()
+    if cursor.rowcount == 0:
+        return None
+    cursor.execute("SELECT * FROM jobs WHERE id = ?", (job["id"],))
+    return cursor.fetchone()
+
+def retry_job(job_id, delay):
+    """Puts a running job back in the queue to be retried after delay seconds."""
+    db = get_db()
+    now = time.time()
+    db.execute(
+        "UPDATE jobs SET status = 'pending', available_at = ?, updated_at = ? WHERE id = ?",
+        (now + delay, now, job_id),
+    )
+    db.commit()
+
+def finish_job(job_id, status, result):
+    """
+    Records the final status and result text of a job: 'done', 'failed', or
+    'unknown' when 1win may or may not have executed it.
+    """
+    db = get_db()
+    db.execute(
+        "UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE id = ?",
+        (status, result, time.time(), job_id),
+    )
+    db.commit()
+
+def mark_running_jobs_unknown():
+    """
+    Marks jobs left 'running' by a previous process as 'unknown' and returns
+    them: their 1win call may already have gone through, so they must not be
+    resent blindly. Called once at startup, before any worker is started.
+    """
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM jobs WHERE status = 'running'")
+    jobs = cursor.fetchall()
+    cursor.execute(
+        "UPDATE jobs SET status = 'unknown', result = ?, updated_at = ? WHERE status = 'running'",
+        ("Interrupted by a restart", time.time()),
+    )
+    db.commit()
+    return jobs
+
+def get_pending_jobs_by_manager():
+    """Returns {manager: (count, oldest available_at)} for pending jobs that are due."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(
+        """
+        SELECT manager, COUNT(*) AS n, MIN(available_at) AS oldest FROM jobs
+        WHERE status = 'pending' AND available_at <= ? GROUP BY manager
+        """,
+        (time.time(),),
+    )
+    return {row["manager"] or "": (row["n"], row["oldest"]) for row in cursor.fetchall()}
+
+def purge_finished_jobs(older_than):
+    """Deletes finished jobs last updated more than older_than seconds ago."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(
+        "DELETE FROM jobs WHERE status IN ('done', 'failed', 'unknown') AND updated_at < ?",
+        (time.time() - older_than,),
+    )
+    db.commit()
+    return cursor.rowcount
+
+def get_finished_jobs(kind, status, within):
+    """Returns jobs of a kind that finished with status in the last within seconds."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT * FROM jobs WHERE kind = ? AND status = ? AND updated_at >= ? ORDER BY updated_at",
+        (kind, status, time.time() - within),
+    )
+    return cursor.fetchall()
+
+def count_jobs_by_status():
+    """Returns a {status: count} mapping for the jobs table."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+    return {row["status"]: row["n"] for row in cursor.fetchall()}
@@ -1,10 +1,20 @@
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 import database as db
-from config import ADMIN_IDS, API_KEY
-from api_client import WinAPIClient
+import config
+from admins import reload_admins
+from operations import operation_error_text
+import backup
+import profiler
+import tracing
+import asyncio
+import io
 import logging
+import os
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -22,9 +32,10 @@ def get_main_keyboard():
 
 # --- Helper Functions ---
 def is_admin(update):
-    return update.effective_user.id in ADMIN_IDS
+    return update.effective_user.id in config.ADMIN_IDS
 
 # --- Command Handlers ---
+@tracing.traced()
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     username = user.username or "Unknown"
@@ -55,6 +66,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_main_keyboard()
         )
 
+def _manager_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """The @username of the manager this user should contact (see PresenceIndex.next_manager)."""
+    presence = context.bot_data.get("presence")
+    manager = presence.next_manager(update.effective_user.id) if presence is not None else None
+    if manager is None:
+        return "@manager\\_username"
+    return "@" + escape_markdown(manager, version=1)
+
+@tracing.traced()
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     
@@ -62,7 +82,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "💰 **Пополнение баланса**\n\n"
             "Для пополнения баланса обратитесь к нашему менеджеру:\n"
-            "@manager_username\n\n"
+            f"{_manager_contact(update, context)}\n\n"
             "Менеджер поможет вам с пополнением счета!",
             parse_mode=ParseMode.MARKDOWN
         )
@@ -70,7 +90,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "💸 **Вывод средств**\n\n"
             "Для вывода средств обратитесь к нашему менеджеру:\n"
-            "@manager_username\n\n"
+            f"{_manager_contact(update, context)}\n\n"
             "Менеджер обработает ваш запрос на вывод!",
             parse_mode=ParseMode.MARKDOWN
         )
@@ -127,6 +147,9 @@ async def receive_manager_username(update: Update, context: ContextTypes.DEFAULT
     
     # Automatically add manager without requiring them to message first
     if db.add_manager(username):
+        presence = context.bot_data.get("presence")
+        if presence is not None:
+            presence.refresh()
         await update.message.reply_text(
             f"✅ Менеджер @{username} успешно добавлен!\n\n"
             f"Теперь @{username} может использовать команды:\n"
@@ -156,6 +179,9 @@ async def receive_delete_username(update: Update, context: ContextTypes.DEFAULT_
         username = username[1:]
 
     if db.delete_manager(username):
+        presence = context.bot_data.get("presence")
+        if presence is not None:
+            presence.refresh()
         await update.message.reply_text(f"✅ Менеджер @{username} успешно удален из списка.")
     else:
         await update.message.reply_text(f"❌ Менеджер @{username} не найден в списке.")
@@ -166,20 +192,227 @@ async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text("Операция отменена.")
     return ConversationHandler.END
 
+def _managers_page(after_id=None, before_id=None):
+    """
+    Builds the text and navigation keyboard for one page of /listmanagers.
+    Returns (None, None) when there are no managers at all.
+    """
+    managers, has_more = db.get_managers_page(
+        after_id=after_id, before_id=before_id, limit=config.MANAGERS_PAGE_SIZE
+    )
+    if not managers and (after_id or before_id):
+        # The page we were on emptied out (managers deleted); start over
+        return _managers_page()
+    if not managers:
+        return None, None
+
+    if before_id is not None:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after_id is not None, has_more
+
+    message_text = "*Список текущих менеджеров:*\n\n"
+    message_text += "\n".join(
+        [f"• `@{manager['username']}` — назначений: {manager['assignment_count']}" for manager in managers]
+    )
+
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"managers:prev:{managers[0]['id']}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"managers:next:{managers[-1]['id']}"))
+    return message_text, InlineKeyboardMarkup([buttons]) if buttons else None
+
 async def list_managers_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update):
         await update.message.reply_text("У вас нет прав для выполнения этой команды.")
         return
 
-    managers = db.get_all_managers()
-    if not managers:
+    message_text, keyboard = _managers_page()
+    if message_text is None:
         await update.message.reply_text("Список менеджеров пуст.")
         return
 
-    message_text = "*Список текущих менеджеров:*\n\n"
-    message_text += "\n".join([f"• `@{manager}`" for manager in managers])
+    await update.message.reply_text(message_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=keyboard)
+
+async def list_managers_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles the next/prev buttons of /listmanagers by editing the message in place."""
+    query = update.callback_query
+    if not is_admin(update):
+        await query.answer("У вас нет прав для выполнения этой команды.")
+        return
+    await query.answer()
+
+    _, direction, manager_id = query.data.split(":")
+    if direction == "next":
+        message_text, keyboard = _managers_page(after_id=int(manager_id))
+    else:
+        message_text, keyboard = _managers_page(before_id=int(manager_id))
+
+    try:
+        if message_text is None:
+            await query.edit_message_text("Список менеджеров пуст.")
+        else:
+            await query.edit_message_text(message_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=keyboard)
+    except BadRequest as e:
+        # e.g. "Message is not modified" after a double tap
+        logger.info(f"Managers page not updated: {e}")
+
+async def reload_config_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды.")
+        return
+
+    try:
+        added, removed = await reload_admins(context.bot)
+    except Exception as e:
+        logger.error(f"Admin reload failed: {e}")
+        await update.message.reply_text(
+            f"❌ Не удалось перечитать настройки, текущие администраторы сохранены.\n\n{e}"
+        )
+        return
+
+    await update.message.reply_text(
+        f"✅ Настройки перечитаны.\n\n"
+        f"👥 Администраторов: {len(config.ADMIN_IDS)}\n"
+        f"➕ Добавлено: {', '.join(map(str, sorted(added))) or 'нет'}\n"
+        f"➖ Удалено: {', '.join(map(str, sorted(removed))) or 'нет'}"
+    )
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды.")
+        return
+
+    operations = context.bot_data.get("operations")
+    if operations is None:
+        await update.message.reply_text("Очередь операций еще не запущена.")
+        return
+
+    jobs = db.count_jobs_by_status()
+    lines = [
+        "📊 Состояние очереди операций",
+        "",
+        f"В очереди: {jobs.get('pending', 0)}, выполняется: {jobs.get('running', 0)}, "
+        f"готово: {jobs.get('done', 0)}, ошибок: {jobs.get('failed', 0)}, "
+        f"результат неизвестен: {jobs.get('unknown', 0)}",
+    ]
+
+    scheduler = operations.scheduler.stats()
+    lines += ["", f"Запросы в 1win: {scheduler['in_flight']} из {scheduler['max_concurrency']}"]
+    # Queue depth counts jobs still in the table too, not just those already claimed
+    pending = db.get_pending_jobs_by_manager()
+    now = time.time()
+    for manager in sorted(set(scheduler["managers"]) | set(pending)):
+        flow = scheduler["managers"].get(manager)
+        in_table, oldest = pending.get(manager, (0, None))
+        line = f"• @{manager}: очередь {in_table + (flow['queued'] if flow else 0)}"
+        if oldest is not None:
+            line += f" (старейшая ждет {now - oldest:.0f}с)"
+        if flow:
+            line += (
+                f", в работе {flow['in_flight']}, вес {flow['weight']:g}, "
+                f"ожидание p50 {flow['wait_p50']:.2f}с / p95 {flow['wait_p95']:.2f}с"
+            )
+        lines.append(line)
+
+    watchdog = context.bot_data.get("watchdog")
+    if watchdog is not None:
+        lag = watchdog.stats()
+        lines += [
+            "",
+            f"Задержка event loop: p50 {lag['p50'] * 1000:.0f} мс, p95 {lag['p95'] * 1000:.0f} мс, "
+            f"p99 {lag['p99'] * 1000:.0f} мс, макс. {lag['max'] * 1000:.0f} мс, зависаний {lag['stalls']}",
+        ]
+
+    limits = context.bot_data.get("limits")
+    if limits is not None:
+        limit_stats = limits.stats()
+        rejected = ", ".join(f"{reason}: {count}" for reason, count in sorted(limit_stats["rejected"].items()))
+        lines += ["", f"Отклонено локально: {rejected or 'нет'} (пользователей в памяти: {limit_stats['tracked_users']})"]
+
+    outbound = context.bot.rate_limiter
+    if outbound is not None:
+        sends = outbound.stats()
+        lines += [
+            "",
+            f"Исходящие сообщения: в очереди {sends['queued']}, отправлено {sends['sent']}, "
+            f"RetryAfter {sends['retry_afters']}",
+            f"Ожидание в очереди p50 {sends['wait_p50'] * 1000:.0f} мс / p95 {sends['wait_p95'] * 1000:.0f} мс, "
+            f"отправка p50 {sends['latency_p50'] * 1000:.0f} мс / p95 {sends['latency_p95'] * 1000:.0f} мс",
+        ]
+
+    presence = context.bot_data.get("presence")
+    if presence is not None:
+        online = presence.stats()
+        lines += ["", f"Менеджеры онлайн: {online['online']} из {online['managers']}"]
+
+    lines += ["", "API ключи:"]
+    for key in operations.keys.stats():
+        state = "активен" if key["available"] else f"пауза {key['cooldown_left']:.0f}с"
+        lines.append(f"• {key['key']}: в работе {key['outstanding']}, {state}")
+
+    await update.message.reply_text("\n".join(lines))
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды.")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else 10
+        if not 1 <= seconds <= config.PROFILE_MAX_SECONDS:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(
+            f"❌ Использование: /profile <секунды>, от 1 до {config.PROFILE_MAX_SECONDS}."
+        )
+        return
+
+    await update.message.reply_text(f"⏳ Профилирую {seconds} сек...")
+    try:
+        counts = await asyncio.to_thread(
+            profiler.sample_stacks, seconds, config.PROFILE_INTERVAL_MS / 1000
+        )
+    except profiler.ProfilerBusy:
+        await update.message.reply_text("⚠️ Профилирование уже выполняется, попробуйте позже.")
+        return
+
+    summary = "\n".join(
+        f"• {share:.0%} {label}" for label, share in profiler.top_frames(counts)
+    )
+    await update.message.reply_document(
+        document=io.BytesIO(profiler.collapsed(counts).encode("utf-8")),
+        filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed",
+        caption=(
+            f"📈 Профиль за {seconds} сек, {sum(counts.values())} сэмплов.\n"
+            f"Откройте в speedscope.app или flamegraph.pl.\n\n{summary}"
+        )[:1024],
+    )
+
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        await update.message.reply_text("У вас нет прав для выполнения этой команды.")
+        return
+
+    await update.message.reply_text("⏳ Создаю резервную копию базы данных...")
+    try:
+        path = await asyncio.to_thread(backup.create_backup)
+    except Exception as e:
+        logger.error(f"Manual database backup failed: {e}")
+        await update.message.reply_text(f"❌ Не удалось создать резервную копию: {e}")
+        return
+
+    with open(path, "rb") as f:
+        await update.message.reply_document(
+            document=f,
+            filename=os.path.basename(path),
+            caption="💾 Резервная копия базы данных",
+        )
 
-    await update.message.reply_text(message_text, parse_mode=ParseMode.MARKDOWN_V2)
 
 
 # --- Manager API Commands ---
@@ -194,6 +427,7 @@ def is_manager(username: str = None, user_id: int = None) -> bool:
     return False
 
 
+@tracing.traced()
 async def deposit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /deposit command for managers."""
     username = update.effective_user.username
@@ -212,7 +446,9 @@ async def deposit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    if not is_manager(username=username, user_id=user_id_telegram):
+    with tracing.span("db.is_manager"):
+        allowed = is_manager(username=username, user_id=user_id_telegram)
+    if not allowed:
         await update.message.reply_text(
             "❌ У вас нет прав для выполнения этой команды.\n\n"
             "Обратитесь к администратору для добавления в список менеджеров."
@@ -247,14 +483,6 @@ async def deposit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        if amount > 1000000:  # 1 million limit for safety
-            await update.message.reply_text(
-                "❌ Слишком большая сумма!\n\n"
-                "Максимальная сумма депозита: 1,000,000\n"
-                "Попробуйте меньшую сумму."
-            )
-            return
-            
     except ValueError:
         await update.message.reply_text(
             "❌ Неверный формат данных!\n\n"
@@ -267,43 +495,46 @@ async def deposit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Show processing message
-    processing_msg = await update.message.reply_text(
-        f"⏳ **Обрабатываю депозит...**\n\n"
-        f"👤 Пользователь: `{user_id}`\n"
-        f"💰 Сумма: `{amount}`\n"
-        f"🔄 Отправляю запрос в 1win...",
-        parse_mode=ParseMode.MARKDOWN
-    )
+    # Reject locally what 1win would certainly reject (amount range, cooldowns, learned limits)
+    limits = context.bot_data["limits"]
+    with tracing.span("limits.check"):
+        rejection = limits.check_deposit(username, user_id, amount)
+    if rejection:
+        logger.info(f"Deposit by {username} rejected locally: user_id={user_id}, amount={amount}")
+        await update.message.reply_text(rejection)
+        return
     
-    # Log the API call attempt
-    logger.info(f"Making API call for deposit: user_id={user_id}, amount={amount}")
+    # Show processing message
+    with tracing.span("telegram.reply_text"):
+        processing_msg = await update.message.reply_text(
+            f"⏳ **Обрабатываю депозит...**\n\n"
+            f"👤 Пользователь: `{user_id}`\n"
+            f"💰 Сумма: `{amount}`\n"
+            f"🔄 Запрос поставлен в очередь...",
+            parse_mode=ParseMode.MARKDOWN
+        )
     
-    # Make API call
+    # Queue the operation; a worker calls 1win and edits the message above
     try:
-        client = WinAPIClient(API_KEY)
-        result = await client.create_deposit(user_id, amount)
-        
-        # Update message with result
-        await processing_msg.edit_text(result["message"], parse_mode=ParseMode.MARKDOWN)
-        
-        # Log the transaction
-        logger.info(f"Deposit request by {username}: user_id={user_id}, amount={amount}, success={result['success']}")
-        
+        with tracing.span("jobs.enqueue"):
+            job_id = context.bot_data["operations"].submit(
+                "deposit",
+                {"user_id": user_id, "amount": amount},
+                username,
+                processing_msg.chat_id,
+                processing_msg.message_id,
+            )
+        limits.record_attempt(username, user_id)
+        logger.info(f"Queued deposit job {job_id} by {username}: user_id={user_id}, amount={amount}")
     except Exception as e:
         logger.error(f"Error in deposit command: {e}")
         await processing_msg.edit_text(
-            f"❌ **Произошла ошибка при обработке депозита**\n\n"
-            f"**Техническая информация:**\n"
-            f"`{str(e)}`\n\n"
-            f"💡 **Что делать:**\n"
-            f"• Попробуйте еще раз через минуту\n"
-            f"• Проверьте правильность данных\n"
-            f"• Обратитесь к администратору, если проблема повторяется",
+            operation_error_text("deposit", e),
             parse_mode=ParseMode.MARKDOWN
         )
 
 
+@tracing.traced()
 async def withdrawal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /withdrawal command for managers."""
     username = update.effective_user.username
@@ -322,7 +553,9 @@ async def withdrawal_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
     
-    if not is_manager(username=username, user_id=user_id_telegram):
+    with tracing.span("db.is_manager"):
+        allowed = is_manager(username=username, user_id=user_id_telegram)
+    if not allowed:
         await update.message.reply_text(
             "❌ У вас нет прав для выполнения этой команды.\n\n"
             "Обратитесь к администратору для добавления в список менеджеров."
@@ -380,41 +613,29 @@ async def withdrawal_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     # Show processing message
-    processing_msg = await update.message.reply_text(
-        f"⏳ **Обрабатываю вывод...**\n\n"
-        f"👤 Пользователь: `{user_id}`\n"
-        f"🔐 Код: `{code}`\n"
-        f"🔄 Отправляю запрос в 1win...",
-        parse_mode=ParseMode.MARKDOWN
-    )
-    
-    # Log the API call attempt
-    logger.info(f"Making API call for withdrawal: user_id={user_id}, code={code}")
+    with tracing.span("telegram.reply_text"):
+        processing_msg = await update.message.reply_text(
+            f"⏳ **Обрабатываю вывод...**\n\n"
+            f"👤 Пользователь: `{user_id}`\n"
+            f"🔐 Код: `{code}`\n"
+            f"🔄 Запрос поставлен в очередь...",
+            parse_mode=ParseMode.MARKDOWN
+        )
     
-    # Make API call
+    # Queue the operation; a worker calls 1win and edits the message above
     try:
-        client = WinAPIClient(API_KEY)
-        result = await client.process_withdrawal(user_id, code)
-        
-        # Update message with result
-        await processing_msg.edit_text(result["message"], parse_mode=ParseMode.MARKDOWN)
-        
-        # Log the transaction
-        logger.info(f"Withdrawal request by {username}: user_id={user_id}, code={code}, success={result['success']}")
-        
+        with tracing.span("jobs.enqueue"):
+            job_id = context.bot_data["operations"].submit(
+                "withdrawal",
+                {"user_id": user_id, "code": code},
+                username,
+                processing_msg.chat_id,
+                processing_msg.message_id,
+            )
+        logger.info(f"Queued withdrawal job {job_id} by {username}: user_id={user_id}, code={code}")
     except Exception as e:
         logger.error(f"Error in withdrawal command: {e}")
         await processing_msg.edit_text(
-            f"❌ **Произошла ошибка при обработке вывода**\n\n"
-            f"**Техническая информация:**\n"
-            f"`{str(e)}`\n\n"
-            f"💡 **Что делать:**\n"
-            f"• Убедитесь, что пользователь создал запрос на вывод в приложении 1win\n"
-            f"• Проверьте правильность кода подтверждения\n"
-            f"• Попробуйте еще раз через минуту\n"
-            f"• Обратитесь к администратору, если проблема повторяется",
+            operation_error_text("withdrawal", e),
             parse_mode=ParseMode.MARKDOWN
         )
-
-
- 
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import config
+from api_client import WinAPIClient
+
+logger = logging.getLogger(__name__)
+
+# Statuses that take a key out of rotation, and for how long
+COOLDOWN_STATUSES = {
+    403: "KEY_COOLDOWN_FORBIDDEN_SECONDS",
+    429: "KEY_COOLDOWN_RATE_LIMITED_SECONDS",
+}
+COOLDOWN_ERROR_CODES = {
+    "400-07": "KEY_COOLDOWN_INVALID_DESK_SECONDS",
+}
+
+# Rejections specific to one cash desk (not enough cash, invalid desk):
+# 1win did nothing, so the call may be retried on another desk
+DESK_ERROR_CODES = {"400-06", "400-07"}
+
+
+def _affinity_weight(manager: str, key) -> int:
+    # crc32 is linear and skews rendezvous hashing; a real hash spreads managers evenly
+    digest = hashlib.blake2b(f"{manager}:{key.client.api_key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class ApiKey:
+    """One 1win API key bound to its cash desk, with its own client and load counters."""
+
+    def __init__(self, api_key: str, cash_desk: Optional[str] = None):
+        self.client = WinAPIClient(api_key)
+        self.cash_desk = cash_desk
+        # Never log full keys
+        self.name = f"{api_key[:6]}…" + (f" (касса {cash_desk})" if cash_desk else "")
+        self.outstanding = 0
+        self.disabled_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.disabled_until <= now
+
+
+class ApiKeyPool:
+    """
+    Spreads 1win calls across several API keys / cash desks.
+
+    Two strategies are supported:
+    - "least_outstanding": the key with the fewest in-flight requests wins;
+    - "affinity": each manager sticks to one key (rendezvous hashing, so
+      only that manager's traffic moves when a key drops out).
+    Withdrawals always use affinity, so a manager's payouts come from one
+    desk. Keys answering 403, 429 or 400-07 are benched for a cooldown period.
+    """
+
+    STRATEGIES = ("least_outstanding", "affinity")
+
+    def __init__(self, keys: List[ApiKey], strategy: str = "least_outstanding"):
+        if not keys:
+            raise ValueError("ApiKeyPool needs at least one key")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown key pool strategy: {strategy}")
+        self.keys = keys
+        self.strategy = strategy
+
+    @classmethod
+    def from_config(cls):
+        keys = [ApiKey(api_key, cash_desk) for api_key, cash_desk in config.API_KEYS]
+        logger.info(f"API key pool: {len(keys)} key(s), strategy {config.KEY_POOL_STRATEGY}")
+        return cls(keys, config.KEY_POOL_STRATEGY)
+
+    def _pick(self, manager: Optional[str], pinned: bool, exclude) -> ApiKey:
+        now = time.monotonic()
+        if pinned and manager and not exclude:
+            # The manager's own desk, even while benched: callers wait for it
+            # instead of moving the request to another desk
+            return max(self.keys, key=lambda key: _affinity_weight(manager, key))
+
+        allowed = [key for key in self.keys if key not in exclude] or self.keys
+        candidates = [key for key in allowed if key.available(now)]
+        if not candidates:
+            # Everything is benched: use the key that comes back soonest
+            return min(allowed, key=lambda key: key.disabled_until)
+
+        if (pinned or self.strategy == "affinity") and manager:
+            return max(
+                candidates,
+                key=lambda key: _affinity_weight(manager, key),
+            )
+        return min(candidates, key=lambda key: key.outstanding)
+
+    @contextmanager
+    def lease(self, manager: Optional[str] = None, pinned: bool = False, exclude=()):
+        """
+        Picks a key for one request and counts it as outstanding meanwhile.
+        pinned forces manager affinity and returns the manager's desk even
+        when it is benched; keys in exclude (desks that already refused this
+        request) are only used if nothing else is left.
+        """
+        key = self._pick(manager, pinned, exclude)
+        key.outstanding += 1
+        try:
+            yield key
+        finally:
+            key.outstanding -= 1
+
+    def report(self, key: ApiKey, result: Dict[str, Any]):
+        """Benches the key if the API rejected it for access, rate limiting or its desk."""
+        setting = COOLDOWN_STATUSES.get(result.get("status")) or COOLDOWN_ERROR_CODES.get(result.get("error_code"))
+        if setting is None:
+            return
+        cooldown = getattr(config, setting)
+        key.disabled_until = time.monotonic() + cooldown
+        logger.warning(
+            f"API key {key.name} returned {result.get('error_code') or result['status']}, "
+            f"out of rotation for {cooldown:.0f}s"
+        )
+
+    def has_alternative(self, exclude) -> bool:
+        """Whether a key outside exclude is currently available."""
+        now = time.monotonic()
+        return any(key.available(now) for key in self.keys if key not in exclude)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "key": key.name,
+                "outstanding": key.outstanding,
+                "available": key.available(now),
+                "cooldown_left": max(key.disabled_until - now, 0.0),
+            }
+            for key in self.keys
+        ]
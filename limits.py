@@ -0,0 +1,198 @@
+import collections
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Per-user state is pruned once this many 1win users are tracked
+MAX_TRACKED_USERS = 50000
+
+
+class _UserState:
+    """What we know about one 1win user's deposits."""
+
+    __slots__ = ("blocked_until", "min_good", "max_good", "floor", "ceiling", "failed", "learned_at", "attempts")
+
+    def __init__(self):
+        self.blocked_until = 0.0
+        self.min_good = None   # smallest amount that went through
+        self.max_good = None   # largest amount that went through
+        self.floor = None      # amounts at or below this fail (400-01)
+        self.ceiling = None    # amounts at or above this fail (400-01)
+        self.failed = set()    # exact amounts that failed when no bound could be inferred
+        self.learned_at = 0.0
+        self.attempts = collections.deque()
+
+
+def _trim(window: collections.deque, now: float, length: float):
+    while window and window[0] <= now - length:
+        window.popleft()
+
+
+class LimitEngine:
+    """
+    Local pre-flight checks for deposits, so requests that are certain to fail
+    upstream are rejected without spending a round trip or 1win quota.
+
+    Seeded from config (amount range, sliding-window quotas, cooldown) and
+    refined from API responses:
+    - a successful deposit starts a cooldown for that 1win user, and so does
+      400-02 (deposit already created);
+    - 400-01 (amount limits) becomes a per-user ceiling when a smaller amount
+      already succeeded, a floor when a larger one did, and otherwise only
+      that exact amount is remembered. Everything learned, including the
+      successful amounts behind the bounds, expires after a TTL.
+    """
+
+    def __init__(self):
+        self._users: Dict[int, _UserState] = {}
+        self._managers: Dict[str, collections.deque] = collections.defaultdict(collections.deque)
+        self.rejected = collections.Counter()
+
+    def _user(self, user_id: int) -> _UserState:
+        state = self._users.get(user_id)
+        if state is None:
+            if len(self._users) >= MAX_TRACKED_USERS:
+                self._prune(time.monotonic())
+            state = self._users[user_id] = _UserState()
+        return state
+
+    def _prune(self, now: float):
+        """Forgets users with nothing active; if that isn't enough, the least recently learned half."""
+        window = config.LIMIT_WINDOW_SECONDS
+        for user_id in list(self._users):
+            state = self._users[user_id]
+            _trim(state.attempts, now, window)
+            expired = now - state.learned_at > config.LIMIT_LEARN_TTL_SECONDS
+            if state.blocked_until <= now and not state.attempts and expired:
+                del self._users[user_id]
+        if len(self._users) >= MAX_TRACKED_USERS:
+            by_age = sorted(self._users, key=lambda user_id: self._users[user_id].learned_at)
+            for user_id in by_age[: len(by_age) // 2]:
+                del self._users[user_id]
+
+    def _reject(self, reason: str, text: str) -> str:
+        self.rejected[reason] += 1
+        return text
+
+    def check_deposit(self, manager: str, user_id: int, amount: float) -> Optional[str]:
+        """Returns a message explaining why the deposit would fail, or None to let it through."""
+        now = time.monotonic()
+
+        if amount < config.DEPOSIT_MIN_AMOUNT:
+            return self._reject("min_amount", (
+                f"❌ Слишком маленькая сумма!\n\n"
+                f"Минимальная сумма депозита: {config.DEPOSIT_MIN_AMOUNT:,.0f}\n"
+                f"Попробуйте большую сумму."
+            ))
+        if amount > config.DEPOSIT_MAX_AMOUNT:
+            return self._reject("max_amount", (
+                f"❌ Слишком большая сумма!\n\n"
+                f"Максимальная сумма депозита: {config.DEPOSIT_MAX_AMOUNT:,.0f}\n"
+                f"Попробуйте меньшую сумму."
+            ))
+
+        state = self._users.get(user_id)
+        if state is not None:
+            if state.blocked_until > now:
+                return self._reject("cooldown", (
+                    f"❌ Для пользователя {user_id} уже создан депозит.\n\n"
+                    f"Новый депозит можно создать через {state.blocked_until - now:.0f} сек."
+                ))
+
+            if now - state.learned_at <= config.LIMIT_LEARN_TTL_SECONDS:
+                if (
+                    (state.ceiling is not None and amount >= state.ceiling)
+                    or (state.floor is not None and amount <= state.floor)
+                    or amount in state.failed
+                ):
+                    return self._reject("learned_limit", (
+                        f"❌ Сумма {amount:g} не подходит для пользователя {user_id}.\n\n"
+                        f"1win уже отклонил такую сумму из-за лимитов пользователя "
+                        f"(ошибка #400-01). Попробуйте другую сумму."
+                    ))
+
+            if config.USER_DEPOSITS_PER_WINDOW:
+                _trim(state.attempts, now, config.LIMIT_WINDOW_SECONDS)
+                if len(state.attempts) >= config.USER_DEPOSITS_PER_WINDOW:
+                    return self._reject("user_window", (
+                        f"❌ Слишком много депозитов для пользователя {user_id}.\n\n"
+                        f"Не больше {config.USER_DEPOSITS_PER_WINDOW} за "
+                        f"{config.LIMIT_WINDOW_SECONDS:.0f} сек. Попробуйте позже."
+                    ))
+
+        if config.MANAGER_DEPOSITS_PER_WINDOW:
+            window = self._managers[manager]
+            _trim(window, now, config.LIMIT_WINDOW_SECONDS)
+            if len(window) >= config.MANAGER_DEPOSITS_PER_WINDOW:
+                return self._reject("manager_window", (
+                    f"❌ Слишком много депозитов.\n\n"
+                    f"Не больше {config.MANAGER_DEPOSITS_PER_WINDOW} за "
+                    f"{config.LIMIT_WINDOW_SECONDS:.0f} сек. Попробуйте позже."
+                ))
+        return None
+
+    def record_attempt(self, manager: str, user_id: int):
+        """Counts a deposit that passed the checks against the sliding windows."""
+        now = time.monotonic()
+        # Windows are trimmed on every append, so they never hold more than one window
+        if config.USER_DEPOSITS_PER_WINDOW:
+            attempts = self._user(user_id).attempts
+            attempts.append(now)
+            _trim(attempts, now, config.LIMIT_WINDOW_SECONDS)
+        if config.MANAGER_DEPOSITS_PER_WINDOW:
+            window = self._managers[manager]
+            window.append(now)
+            _trim(window, now, config.LIMIT_WINDOW_SECONDS)
+
+    def record_result(self, user_id: int, amount: float, result: Dict[str, Any], age: float = 0.0):
+        """Learns from a deposit's API result. age is how long ago the result was received."""
+        now = time.monotonic() - age
+        code = result.get("error_code")
+        if not result["success"] and code not in ("400-01", "400-02"):
+            return
+
+        state = self._user(user_id)
+        if now - state.learned_at > config.LIMIT_LEARN_TTL_SECONDS:
+            # Stale successes would turn the next 400-01 into a bound it doesn't prove
+            state.min_good = state.max_good = None
+            state.floor = state.ceiling = None
+            state.failed.clear()
+
+        if result["success"]:
+            # A success overrides anything we inferred that would have rejected it
+            if state.ceiling is not None and amount >= state.ceiling:
+                state.ceiling = None
+            if state.floor is not None and amount <= state.floor:
+                state.floor = None
+            state.failed.discard(amount)
+            state.blocked_until = now + config.DEPOSIT_COOLDOWN_SECONDS
+            state.min_good = amount if state.min_good is None else min(state.min_good, amount)
+            state.max_good = amount if state.max_good is None else max(state.max_good, amount)
+            state.learned_at = now
+        elif code == "400-02":
+            state.blocked_until = now + config.DEPOSIT_COOLDOWN_SECONDS
+        elif code == "400-01":
+            if state.max_good is not None and amount > state.max_good:
+                state.ceiling = amount if state.ceiling is None else min(state.ceiling, amount)
+            elif state.min_good is not None and amount < state.min_good:
+                state.floor = amount if state.floor is None else max(state.floor, amount)
+            else:
+                state.failed.add(amount)
+            state.learned_at = now
+
+    def seed(self, jobs):
+        """Replays recent successful deposit jobs, so cooldowns survive a restart."""
+        now = time.time()
+        for job in jobs:
+            payload = json.loads(job["payload"])
+            self.record_result(
+                payload["user_id"], payload["amount"], {"success": True}, age=now - job["updated_at"]
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tracked_users": len(self._users), "rejected": dict(self.rejected)}
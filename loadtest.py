@@ -0,0 +1,329 @@
+"""
+End-to-end load generator for the bot.
+
+Starts two local stand-ins, a fake Telegram Bot API (getUpdates, sendMessage,
+editMessageText, ...) and a fake 1win API (deposit/withdrawal with configurable
+latency and error mix), runs the real bot (main.py) against them in a
+subprocess and feeds it synthetic traffic from many users and managers.
+
+Each stage offers a fixed update rate and reports completed updates/s,
+p50/p95/p99 latency per command and error rates; step through several rates
+to find the saturation point:
+
+    python loadtest.py --users 5000 --managers 200 --rates 50,100,200,400 --duration 30
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+import database as db
+from scheduler import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOT_TOKEN = "123456:LOADTEST"
+
+MENU_TEXTS = ["Пополнить игровой баланс", "Вывод", "Поддержка 24/7", "Новостной канал"]
+
+
+class FakeTelegram:
+    """Just enough of the Bot API for python-telegram-bot's polling loop."""
+
+    def __init__(self, on_bot_message):
+        self.on_bot_message = on_bot_message
+        self.updates = collections.deque()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.new_updates = asyncio.Event()
+        self.polling = asyncio.Event()
+        self.calls = collections.Counter()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        handler = getattr(self, f"api_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def api_getMe(self, params):
+        return {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+
+    async def api_getUpdates(self, params):
+        self.polling.set()
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return [self.updates[i] for i in range(min(limit, len(self.updates)))]
+
+    def _message(self, chat_id, text, message_id=None):
+        if message_id is None:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "LoadTest"},
+            "text": text,
+        }
+
+    async def api_sendMessage(self, params):
+        chat_id, text = int(params["chat_id"]), params["text"]
+        self.on_bot_message(chat_id, text)
+        return self._message(chat_id, text)
+
+    async def api_editMessageText(self, params):
+        chat_id, text = int(params["chat_id"]), params["text"]
+        self.on_bot_message(chat_id, text)
+        return self._message(chat_id, text, int(params["message_id"]))
+
+    def push(self, user_id, username, text):
+        message = {
+            "message_id": self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": username, "username": username},
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        self.next_message_id += 1
+        self.updates.append({"update_id": self.next_update_id, "message": message})
+        self.next_update_id += 1
+        self.new_updates.set()
+
+
+class FakeWinAPI:
+    """Stand-in for api.1win.win/v1/client with configurable latency and errors."""
+
+    ERRORS = [
+        (400, {"errorCode": "CASH01", "errorMessage": "Amount exceeds limit"}),
+        (400, {"errorCode": "CASH03", "errorMessage": "Deposit already created"}),
+        (429, {"errorCode": "CASH06", "errorMessage": "TooManyRequests"}),
+        (500, {"errorMessage": "Internal server error"}),
+    ]
+
+    def __init__(self, latency, jitter, error_rate):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = collections.Counter()
+        self.next_id = 1
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v1/client/{endpoint}", self.handle)
+        return app
+
+    async def handle(self, request):
+        endpoint = request.match_info["endpoint"]
+        body = await request.json()
+        await asyncio.sleep(max(random.gauss(self.latency, self.jitter), 0))
+
+        if random.random() < self.error_rate:
+            status, error = random.choice(self.ERRORS)
+            self.calls[f"{endpoint} {status}"] += 1
+            return web.json_response(error, status=status)
+
+        self.calls[f"{endpoint} 200"] += 1
+        self.next_id += 1
+        return web.json_response({
+            "id": self.next_id,
+            "amount": body.get("amount", 100),
+            "userId": body["userId"],
+            "cashId": 1,
+        })
+
+
+class LoadGenerator:
+    """Open-loop traffic: each actor has at most one command awaiting a reply."""
+
+    def __init__(self, users, managers):
+        self.actors = [(1_000_000 + i, f"loaduser{i}", False) for i in range(users)]
+        self.actors += [(2_000_000 + i, f"loadmgr{i}", True) for i in range(managers)]
+        self.pending = {}  # chat_id -> (command, sent_at)
+        self.reset()
+        self.telegram = FakeTelegram(self.on_bot_message)
+
+    def reset(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.sent = collections.Counter()
+        self.skipped = 0
+
+    def _command(self, is_manager):
+        if is_manager and random.random() < 0.8:
+            user_id = random.randint(100000, 9999999)
+            if random.random() < 0.7:
+                return "deposit", f"/deposit {user_id} {random.randint(100, 50000)}"
+            return "withdrawal", f"/withdrawal {user_id} {random.randint(1000, 9999)}"
+        if random.random() < 0.3:
+            return "start", "/start"
+        return "menu", random.choice(MENU_TEXTS)
+
+    def on_bot_message(self, chat_id, text):
+        entry = self.pending.get(chat_id)
+        # "⏳" marks the interim status message of a queued operation
+        if entry is None or text.startswith("⏳"):
+            return
+        command, sent_at = self.pending.pop(chat_id)
+        self.latencies[command].append(time.monotonic() - sent_at)
+        if text.startswith(("❌", "⚠️")):
+            self.errors[command] += 1
+
+    def send_one(self):
+        for _ in range(10):
+            chat_id, username, is_manager = random.choice(self.actors)
+            if chat_id not in self.pending:
+                break
+        else:
+            self.skipped += 1
+            return
+        command, text = self._command(is_manager)
+        self.pending[chat_id] = (command, time.monotonic())
+        self.sent[command] += 1
+        self.telegram.push(chat_id, username, text)
+
+    async def run_stage(self, rate, duration):
+        self.reset()
+        started = time.monotonic()
+        while time.monotonic() - started < duration:
+            self.send_one()
+            await asyncio.sleep(random.expovariate(rate))
+        return time.monotonic() - started
+
+    def report(self, rate, elapsed):
+        completed = sum(len(samples) for samples in self.latencies.values())
+        print(f"\n=== offered {rate:g} updates/s for {elapsed:.0f}s ===")
+        print(f"sent {sum(self.sent.values())}, completed {completed} "
+              f"({completed / elapsed:.1f} updates/s), still pending {len(self.pending)}, "
+              f"skipped (all sampled actors busy) {self.skipped}")
+        print(f"{'command':<12}{'sent':>8}{'done':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+        for command in sorted(self.sent):
+            samples = self.latencies[command]
+            error_rate = self.errors[command] / len(samples) if samples else 0.0
+            print(
+                f"{command:<12}{self.sent[command]:>8}{len(samples):>8}"
+                f"{percentile(samples, 0.50) * 1000:>10.1f}"
+                f"{percentile(samples, 0.95) * 1000:>10.1f}"
+                f"{percentile(samples, 0.99) * 1000:>10.1f}"
+                f"{error_rate:>8.1%}"
+            )
+
+
+async def start_site(app, port):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+def prepare_database(path, managers):
+    db.DATABASE_FILE = path
+    db.init_db()
+    for i in range(managers):
+        db.add_manager(f"loadmgr{i}")
+    db.close_db()
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    database_file = os.path.join(workdir, "bot_database.db")
+    prepare_database(database_file, args.managers)
+
+    generator = LoadGenerator(args.users, args.managers)
+    winapi = FakeWinAPI(args.api_latency, args.api_jitter, args.api_error_rate)
+    telegram_runner, telegram_port = await start_site(generator.telegram.app(), 0)
+    winapi_runner, winapi_port = await start_site(winapi.app(), 0)
+
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        TELEGRAM_BASE_URL=f"http://127.0.0.1:{telegram_port}/bot",
+        API_BASE_URL=f"http://127.0.0.1:{winapi_port}/v1/client",
+        API_KEYS=",".join(f"loadtest-key-{i}:{i}" for i in range(args.api_keys)),
+        DATABASE_FILE=database_file,
+        ADMINS_FILE=os.path.join(workdir, "admins.json"),
+        TRACE_FILE=os.path.join(workdir, "traces.jsonl"),
+    )
+    env.pop("RENDER", None)
+    log_path = os.path.join(workdir, "bot.log")
+    print(f"Work directory: {workdir}")
+
+    with open(log_path, "wb") as log:
+        bot = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(HERE, "main.py"),
+            cwd=workdir, env=env, stdout=log, stderr=asyncio.subprocess.STDOUT,
+        )
+        try:
+            await asyncio.wait_for(generator.telegram.polling.wait(), args.startup_timeout)
+            for rate in args.rates:
+                elapsed = await generator.run_stage(rate, args.duration)
+                # Let in-flight commands finish before reporting
+                drain_until = time.monotonic() + args.drain
+                while generator.pending and time.monotonic() < drain_until:
+                    await asyncio.sleep(0.1)
+                generator.report(rate, elapsed)
+                generator.pending.clear()
+        except asyncio.TimeoutError:
+            print(f"Bot did not start polling within {args.startup_timeout}s, see {log_path}")
+        finally:
+            if bot.returncode is None:
+                bot.send_signal(signal.SIGINT)
+                try:
+                    await asyncio.wait_for(bot.wait(), 20)
+                except asyncio.TimeoutError:
+                    bot.kill()
+            await telegram_runner.cleanup()
+            await winapi_runner.cleanup()
+
+    print(f"\nBot API calls: {dict(generator.telegram.calls)}")
+    print(f"1win API calls: {dict(winapi.calls)}")
+    print(f"Bot log: {log_path}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000, help="synthetic regular users")
+    parser.add_argument("--managers", type=int, default=100, help="synthetic managers (pre-registered)")
+    parser.add_argument("--rates", default="20,50,100", help="comma-separated offered updates/s, one stage each")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per stage")
+    parser.add_argument("--drain", type=float, default=30, help="seconds to wait for replies after a stage")
+    parser.add_argument("--api-latency", type=float, default=0.3, help="mean fake 1win latency, seconds")
+    parser.add_argument("--api-jitter", type=float, default=0.1, help="stddev of fake 1win latency, seconds")
+    parser.add_argument("--api-error-rate", type=float, default=0.05, help="fraction of 1win calls that fail")
+    parser.add_argument("--api-keys", type=int, default=1, help="number of fake API keys in the pool")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    args = parser.parse_args()
+    args.rates = [float(rate) for rate in args.rates.split(",") if rate.strip()]
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
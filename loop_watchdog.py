@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import config
+from scheduler import percentile
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Lag samples kept for the percentiles in stats()
+LAG_SAMPLES = 1000
+
+
+def _blocking_handler(frame) -> str:
+    """
+    Names the code responsible for a stall: the outermost frame in handlers.py
+    if there is one, else the innermost frame of this project, else the
+    innermost frame overall.
+    """
+    handler = project = None
+    innermost = frame
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if os.path.dirname(os.path.abspath(filename)) == HERE:
+            if project is None:
+                project = frame
+            if os.path.basename(filename) == "handlers.py":
+                handler = frame
+        frame = frame.f_back
+
+    found = handler or project or innermost
+    return f"{found.f_code.co_name} ({os.path.basename(found.f_code.co_filename)}:{found.f_lineno})"
+
+
+class LoopWatchdog:
+    """
+    Measures event loop lag and catches whatever is blocking it.
+
+    A heartbeat task sleeps for a fixed interval and records how late it
+    wakes up. A separate thread watches the heartbeat; once it is overdue by
+    more than the stall threshold, the thread grabs the loop thread's current
+    stack, which is the blocking callback itself, and logs it once per stall.
+    """
+
+    def __init__(self, interval: float = None, threshold: float = None):
+        self.interval = interval or config.LOOP_WATCHDOG_INTERVAL_MS / 1000
+        self.threshold = threshold or config.LOOP_STALL_THRESHOLD_MS / 1000
+        self.lags = collections.deque(maxlen=LAG_SAMPLES)
+        self.stalls = 0
+        self._last_beat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._stop = threading.Event()
+
+    async def start(self):
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logger.info(
+            f"Loop watchdog started (interval {self.interval * 1000:.0f} ms, "
+            f"stall threshold {self.threshold * 1000:.0f} ms)"
+        )
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._last_beat = time.monotonic()
+            self.lags.append(max(self._last_beat - started - self.interval, 0.0))
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.interval):
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            reported = True
+            self.stalls += 1
+            logger.warning(
+                f"Event loop blocked for {overdue * 1000:.0f} ms in {_blocking_handler(frame)}:\n"
+                + "".join(traceback.format_stack(frame))
+            )
+
+    def stats(self):
+        lags = list(self.lags)
+        return {
+            "p50": percentile(lags, 0.50),
+            "p95": percentile(lags, 0.95),
+            "p99": percentile(lags, 0.99),
+            "max": max(lags, default=0.0),
+            "stalls": self.stalls,
+        }
@@ -1,10 +1,14 @@
+import asyncio
 import logging
-from telegram import BotCommand, BotCommandScopeChat
+import signal
+from telegram import BotCommand, Update
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     ConversationHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 from threading import Thread
@@ -12,6 +16,14 @@ import os
 
 import config
 import database as db
+import tracing
+from backup import backup_job
+from admins import admin_filter, reload_admins, set_admin_commands
+from limits import LimitEngine
+from operations import OperationQueue
+from outbound import OutboundQueue
+from presence import PresenceIndex, decay_presence_job, flush_presence_job, track_presence
+from loop_watchdog import LoopWatchdog
 from handlers import (
     start,
     handle_text,
@@ -21,6 +33,11 @@ from handlers import (
     receive_delete_username,
     cancel_conversation,
     list_managers_command,
+    list_managers_page_callback,
+    reload_config_command,
+    stats_command,
+    profile_command,
+    backup_command,
     deposit_command,
     withdrawal_command,
     WAITING_FOR_MANAGER_USERNAME,
@@ -37,8 +54,25 @@ logger = logging.getLogger(__name__)
 
 async def post_init(application: Application) -> None:
     """
-    Post-initialization function to set bot commands.
+    Post-initialization function to start background services and set bot commands.
     """
+    # Watch the event loop for blocking calls
+    watchdog = LoopWatchdog()
+    application.bot_data["watchdog"] = watchdog
+    await watchdog.start()
+
+    # Who is online, for routing users to managers
+    presence = PresenceIndex()
+    presence.load()
+    application.bot_data["presence"] = presence
+
+    # Start the workers that process queued deposits and withdrawals
+    limits = LimitEngine()
+    application.bot_data["limits"] = limits
+    operations = OperationQueue(application.bot, limits)
+    application.bot_data["operations"] = operations
+    await operations.start()
+
     # Commands for regular users (including manager commands visible to all)
     user_commands = [
         BotCommand("start", "Запустить/перезапустить бота"),
@@ -47,23 +81,47 @@ async def post_init(application: Application) -> None:
     ]
     await application.bot.set_my_commands(user_commands)
 
-    # Commands for the admins (includes all commands)
-    admin_commands = [
-        BotCommand("start", "Запустить/перезапустить бота"),
-        BotCommand("deposit", "Создать депозит (только для менеджеров)"),
-        BotCommand("withdrawal", "Обработать вывод (только для менеджеров)"),
-        BotCommand("addmanager", "Добавить менеджера"),
-        BotCommand("delmanager", "Удалить менеджера"),
-        BotCommand("listmanagers", "Показать список менеджеров"),
-    ]
     # Set commands for all admins
-    for admin_id in config.ADMIN_IDS:
-        try:
-            await application.bot.set_my_commands(
-                admin_commands, scope=BotCommandScopeChat(chat_id=admin_id)
-            )
-        except Exception as e:
-            logger.error(f"Could not set commands for admin {admin_id}: {e}")
+    await set_admin_commands(application.bot, config.ADMIN_IDS)
+
+    # SIGHUP re-reads the admin list without a restart (not available on Windows)
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP,
+            lambda: application.create_task(_reload_admins_on_signal(application)),
+        )
+    except (AttributeError, NotImplementedError, RuntimeError):
+        logger.info("SIGHUP reload unavailable; use /reloadconfig instead")
+
+
+async def _reload_admins_on_signal(application: Application) -> None:
+    try:
+        await reload_admins(application.bot)
+    except Exception as e:
+        logger.error(f"Admin reload failed, keeping current admins: {e}")
+
+
+async def post_stop(application: Application) -> None:
+    """
+    Stop background services while the bot can still edit messages.
+    Jobs that were in flight are requeued on the next start.
+    """
+    operations = application.bot_data.get("operations")
+    if operations is not None:
+        await operations.stop()
+    watchdog = application.bot_data.get("watchdog")
+    if watchdog is not None:
+        await watchdog.stop()
+    presence = application.bot_data.get("presence")
+    if presence is not None:
+        presence.flush()
+
+
+async def post_shutdown(application: Application) -> None:
+    """
+    Flush background exporters before the process exits.
+    """
+    tracing.shutdown()
 
 
 def main() -> None:
@@ -83,23 +141,30 @@ def main() -> None:
     # Initialize the database
     db.init_db()
 
+    # Start exporting request traces (no-op when tracing is disabled)
+    tracing.setup()
+
     # Create the Application and pass it your bot's token.
     application = (
         Application.builder()
         .token(config.TOKEN)
+        .base_url(config.TELEGRAM_BASE_URL)
         .connect_timeout(30)
         .read_timeout(30)
         .write_timeout(30)
         .http_version("1.1")
+        .connection_pool_size(config.TELEGRAM_POOL_SIZE)
+        .pool_timeout(config.TELEGRAM_POOL_TIMEOUT)
+        .rate_limiter(OutboundQueue())
         .get_updates_http_version("1.1")
         .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
     # --- Register Handlers ---
-    # Create a filter for the admins
-    admin_filter = filters.User(user_id=config.ADMIN_IDS)
-
+    # Admin-only handlers share admins.admin_filter, which /reloadconfig updates in place
     # Conversation handler for adding and deleting managers
     conv_handler = ConversationHandler(
         entry_points=[
@@ -118,11 +183,20 @@ def main() -> None:
         conversation_timeout=600,  # 10 minutes timeout (longer for manager to respond)
     )
 
+    # Records manager activity for every update before the regular handlers run
+    application.add_handler(TypeHandler(Update, track_presence), group=-1)
+
     application.add_handler(conv_handler)
     
     # Command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("listmanagers", list_managers_command, filters=admin_filter))
+    application.add_handler(CallbackQueryHandler(list_managers_page_callback, pattern=r"^managers:(next|prev):\d+$"))
+    application.add_handler(CommandHandler("backup", backup_command, filters=admin_filter, block=False))
+    # Non-blocking, so other updates keep flowing (and get profiled) meanwhile
+    application.add_handler(CommandHandler("profile", profile_command, filters=admin_filter, block=False))
+    application.add_handler(CommandHandler("reloadconfig", reload_config_command, filters=admin_filter))
+    application.add_handler(CommandHandler("stats", stats_command, filters=admin_filter))
     
     # Manager command handlers (available to all users, but internally filtered)
     application.add_handler(CommandHandler("deposit", deposit_command))
@@ -131,6 +205,22 @@ def main() -> None:
     # Text handler for all other text messages (including reply keyboard)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
 
+    # --- Scheduled Jobs ---
+    if config.BACKUP_INTERVAL_SECONDS > 0:
+        application.job_queue.run_repeating(
+            backup_job, interval=config.BACKUP_INTERVAL_SECONDS, first=60, name="database-backup"
+        )
+    application.job_queue.run_repeating(
+        flush_presence_job, interval=config.PRESENCE_FLUSH_SECONDS, name="presence-flush"
+    )
+    if config.PRESENCE_DECAY_INTERVAL_SECONDS > 0:
+        application.job_queue.run_repeating(
+            decay_presence_job,
+            interval=config.PRESENCE_DECAY_INTERVAL_SECONDS,
+            first=config.PRESENCE_DECAY_INTERVAL_SECONDS,
+            name="presence-decay",
+        )
+
     # --- Start the Bot ---
     logger.info("Starting bot...")
     application.run_polling()
@@ -0,0 +1,319 @@
+import asyncio
+import collections
+import json
+import logging
+import time
+
+from telegram.constants import ParseMode
+from telegram.error import TelegramError
+
+import config
+import database as db
+import tracing
+from api_client import is_transient_failure, is_uncertain_failure
+from key_pool import DESK_ERROR_CODES, ApiKeyPool
+from limits import LimitEngine
+from outbound import PRIORITY_NORMAL, PRIORITY_RESULT
+from scheduler import FairScheduler
+
+logger = logging.getLogger(__name__)
+
+# How often an idle worker is woken to pick up delayed retries that became due
+POLL_INTERVAL = 1.0
+
+
+def _retry_delay(attempts: int) -> float:
+    """Exponential backoff between attempts, capped at JOB_RETRY_MAX_SECONDS."""
+    return min(config.JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), config.JOB_RETRY_MAX_SECONDS)
+
+
+def operation_error_text(kind: str, e: Exception) -> str:
+    """Message shown to the manager when an operation fails with an exception."""
+    if kind == "deposit":
+        return (
+            f"❌ **Произошла ошибка при обработке депозита**\n\n"
+            f"**Техническая информация:**\n"
+            f"`{str(e)}`\n\n"
+            f"💡 **Что делать:**\n"
+            f"• Попробуйте еще раз через минуту\n"
+            f"• Проверьте правильность данных\n"
+            f"• Обратитесь к администратору, если проблема повторяется"
+        )
+    return (
+        f"❌ **Произошла ошибка при обработке вывода**\n\n"
+        f"**Техническая информация:**\n"
+        f"`{str(e)}`\n\n"
+        f"💡 **Что делать:**\n"
+        f"• Убедитесь, что пользователь создал запрос на вывод в приложении 1win\n"
+        f"• Проверьте правильность кода подтверждения\n"
+        f"• Попробуйте еще раз через минуту\n"
+        f"• Обратитесь к администратору, если проблема повторяется"
+    )
+
+
+def operation_unknown_text(kind: str, payload: dict) -> str:
+    """Message shown to the manager when 1win may or may not have executed the operation."""
+    if kind == "deposit":
+        return (
+            f"⚠️ **Результат депозита неизвестен**\n\n"
+            f"1win не подтвердил операцию, но она могла пройти.\n\n"
+            f"👤 ID пользователя: {payload['user_id']}\n"
+            f"💰 Сумма: {payload['amount']}\n\n"
+            f"💡 **Что делать:**\n"
+            f"• Проверьте в кабинете 1win, создан ли депозит\n"
+            f"• Повторяйте /deposit, только если депозита нет"
+        )
+    return (
+        f"⚠️ **Результат вывода неизвестен**\n\n"
+        f"1win не подтвердил операцию, но она могла пройти.\n\n"
+        f"👤 ID пользователя: {payload['user_id']}\n\n"
+        f"💡 **Что делать:**\n"
+        f"• Проверьте в кабинете 1win, выплачен ли вывод\n"
+        f"• Повторяйте /withdrawal, только если вывода нет"
+    )
+
+
+class OperationQueue:
+    """
+    Pool of async workers draining the durable 'jobs' table.
+
+    Handlers enqueue a deposit/withdrawal together with the id of the status
+    message they sent; a worker performs the 1win call and edits that message
+    with the outcome. Failures that prove 1win never executed the call are
+    retried with backoff. When the outcome is uncertain (timeout, 5xx, or a
+    restart in the middle of the call) the job is marked 'unknown' and the
+    manager is asked to check, since resending could pay out twice.
+    """
+
+    def __init__(
+        self,
+        bot,
+        limits: LimitEngine,
+        workers: int = None,
+        keys: ApiKeyPool = None,
+        scheduler: FairScheduler = None,
+    ):
+        self.bot = bot
+        self.limits = limits
+        self.keys = keys or ApiKeyPool.from_config()
+        self.scheduler = scheduler or FairScheduler.from_config()
+        self.worker_count = workers or config.JOB_WORKERS
+        # Futures of idle workers; each wakeup resolves exactly one
+        self._idle = collections.deque()
+        self._tasks = []
+        self._stopping = False
+        # Jobs whose 1win call has started in this process
+        self._dispatched = set()
+
+    # --- Producer side ---
+    def submit(self, kind: str, payload: dict, manager: str, chat_id: int, message_id: int) -> int:
+        """Persists a job and wakes an idle worker. Returns the job id."""
+        job_id = db.enqueue_job(
+            kind,
+            json.dumps(payload),
+            manager,
+            chat_id,
+            message_id=message_id,
+            trace_id=tracing.current_trace_id(),
+        )
+        self._wake_one()
+        return job_id
+
+    def _wake_one(self):
+        """Wakes a single idle worker, if any; busy workers claim again when they finish."""
+        while self._idle:
+            waiter = self._idle.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    # --- Lifecycle ---
+    async def start(self):
+        interrupted = db.mark_running_jobs_unknown()
+        if interrupted:
+            logger.warning(f"{len(interrupted)} job(s) interrupted by the previous shutdown, outcome unknown")
+        for job in interrupted:
+            await self._edit(job, operation_unknown_text(job["kind"], json.loads(job["payload"])), PRIORITY_RESULT)
+        purged = db.purge_finished_jobs(config.JOB_RETENTION_SECONDS)
+        if purged:
+            logger.info(f"Purged {purged} finished job(s)")
+        self.limits.seed(db.get_finished_jobs("deposit", "done", config.DEPOSIT_COOLDOWN_SECONDS))
+
+        limits = [self.scheduler.default_max_in_flight, *self.scheduler.max_in_flight.values()]
+        if max(limits) > config.JOB_MAX_RUNNING_PER_MANAGER:
+            logger.warning(
+                f"JOB_MAX_RUNNING_PER_MANAGER={config.JOB_MAX_RUNNING_PER_MANAGER} caps per-manager "
+                f"in-flight limits up to {max(limits)}"
+            )
+
+        for i in range(self.worker_count):
+            self._tasks.append(asyncio.create_task(self._worker(i), name=f"operation-worker-{i}"))
+        self._tasks.append(asyncio.create_task(self._poll(), name="operation-poller"))
+        logger.info(f"Started {self.worker_count} operation worker(s)")
+
+    async def stop(self):
+        """Stops claiming jobs and gives in-flight 1win calls JOB_STOP_GRACE_SECONDS to finish."""
+        self._stopping = True
+        while self._idle:
+            self._wake_one()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=config.JOB_STOP_GRACE_SECONDS)
+            if pending:
+                logger.warning(f"Interrupting {len(pending)} operation worker(s) still busy at shutdown")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # --- Workers ---
+    async def _worker(self, index: int):
+        failures = 0
+        while not self._stopping:
+            try:
+                job = db.claim_job(config.JOB_MAX_RUNNING_PER_MANAGER)
+                if job is None:
+                    waiter = asyncio.get_running_loop().create_future()
+                    self._idle.append(waiter)
+                    await waiter
+                else:
+                    # More jobs may be due: pass the wakeup on to another idle worker
+                    self._wake_one()
+                    await self._process(index, job)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. "database is locked": keep the worker alive and try again later
+                failures += 1
+                delay = _retry_delay(failures)
+                logger.error(f"Worker {index} error: {e}; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+
+    async def _poll(self):
+        """The only periodic check: wakes one idle worker for retries whose delay has passed."""
+        while not self._stopping:
+            await asyncio.sleep(POLL_INTERVAL)
+            self._wake_one()
+
+    async def _process(self, index: int, job):
+        """Runs one claimed job; a crash marks the job finished instead of killing the worker."""
+        try:
+            await self._run(job)
+        except asyncio.CancelledError:
+            if job["id"] not in self._dispatched:
+                # Never reached 1win: safe to run again after the restart
+                db.retry_job(job["id"], 0)
+            # Otherwise left as 'running'; marked 'unknown' on the next start
+            raise
+        except Exception as e:
+            logger.error(f"Worker {index} crashed on job {job['id']}: {e}")
+            status = "unknown" if job["id"] in self._dispatched else "failed"
+            db.finish_job(job["id"], status, str(e))
+        finally:
+            self._dispatched.discard(job["id"])
+
+    async def _call_api(self, job_id: int, kind: str, payload: dict, manager: str, due_at: float = None) -> dict:
+        # Waits are measured from when the job became due, including its time pending in the table
+        waiting_since = None
+        if due_at is not None:
+            waiting_since = time.monotonic() - max(time.time() - due_at, 0.0)
+        with tracing.span("scheduler.wait", manager=manager):
+            await self.scheduler.acquire(manager, waiting_since)
+        try:
+            tried = []
+            while True:
+                pinned = kind == "withdrawal"
+                with self.keys.lease(manager, pinned=pinned, exclude=tried) as key:
+                    if pinned and not tried and not key.available(time.monotonic()):
+                        # Wait for the manager's own desk to come back rather than move the payout
+                        return {
+                            "success": False,
+                            "message": (
+                                f"❌ **Касса временно недоступна**\n\n"
+                                f"ℹ️ 1win временно не принимает запросы по кассе {key.cash_desk or ''}.\n\n"
+                                f"💡 Попробуйте через несколько минут или обратитесь к администратору."
+                            ),
+                            "status": None,
+                            "not_sent": True,
+                            "retry_after": key.disabled_until - time.monotonic(),
+                        }
+                    with tracing.span(f"winapi.{kind}", key=key.name, outstanding=key.outstanding):
+                        self._dispatched.add(job_id)
+                        if kind == "deposit":
+                            result = await key.client.create_deposit(payload["user_id"], payload["amount"])
+                        elif kind == "withdrawal":
+                            result = await key.client.process_withdrawal(payload["user_id"], payload["code"])
+                        else:
+                            raise ValueError(f"Unknown job kind: {kind}")
+                self.keys.report(key, result)
+
+                # The desk refused without executing anything: try another one
+                tried.append(key)
+                if result.get("error_code") in DESK_ERROR_CODES and self.keys.has_alternative(tried):
+                    logger.warning(f"{kind} job {job_id}: {key.name} answered {result['error_code']}, trying another desk")
+                    continue
+                return result
+        finally:
+            self.scheduler.release(manager)
+
+    async def _run(self, job):
+        kind = job["kind"]
+        payload = json.loads(job["payload"])
+        logger.info(f"Processing {kind} job {job['id']} (attempt {job['attempts']}): {payload}")
+
+        with tracing.trace(f"job.{kind}", trace_id=job["trace_id"], job_id=job["id"], attempt=job["attempts"]):
+            try:
+                result = await self._call_api(job["id"], kind, payload, job["manager"], job["available_at"])
+            except Exception as e:
+                logger.error(f"Error in {kind} job {job['id']}: {e}")
+                result = {
+                    "success": False,
+                    "message": operation_error_text(kind, e),
+                    "status": None,
+                    "not_sent": job["id"] not in self._dispatched,
+                }
+
+            if is_transient_failure(result) and job["attempts"] < config.JOB_MAX_ATTEMPTS:
+                delay = max(_retry_delay(job["attempts"]), result.get("retry_after", 0))
+                db.retry_job(job["id"], delay)
+                logger.warning(f"{kind} job {job['id']} failed transiently, retrying in {delay:.0f}s")
+                await self._edit(
+                    job,
+                    f"⏳ **1win временно недоступен**\n\n"
+                    f"🔄 Повторная попытка через {delay:.0f} сек. "
+                    f"(попытка {job['attempts'] + 1} из {config.JOB_MAX_ATTEMPTS})",
+                )
+                return
+
+            if is_uncertain_failure(result):
+                db.finish_job(job["id"], "unknown", result["message"])
+                logger.warning(f"{kind} job {job['id']} outcome unknown (status {result.get('status')}), not retrying")
+                await self._edit(job, operation_unknown_text(kind, payload), PRIORITY_RESULT)
+                return
+
+            if kind == "deposit":
+                self.limits.record_result(payload["user_id"], payload["amount"], result)
+            db.finish_job(job["id"], "done" if result["success"] else "failed", result["message"])
+            # Transaction results jump ahead of menu replies in the outbound queue
+            await self._edit(job, result["message"], PRIORITY_RESULT)
+
+        # Log the transaction
+        logger.info(
+            f"{kind.capitalize()} request by {job['manager']}: {payload}, success={result['success']}"
+        )
+
+    async def _edit(self, job, text: str, priority: int = PRIORITY_NORMAL):
+        """Replaces the manager's status message; a missing message isn't fatal."""
+        if job["message_id"] is None:
+            return
+        try:
+            with tracing.span("telegram.edit_text"):
+                await self.bot.edit_message_text(
+                    text,
+                    chat_id=job["chat_id"],
+                    message_id=job["message_id"],
+                    parse_mode=ParseMode.MARKDOWN,
+                    rate_limit_args={"priority": priority},
+                )
+        except TelegramError as e:
+            logger.error(f"Could not update status message for job {job['id']}: {e}")
@@ -0,0 +1,224 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import config
+from scheduler import percentile
+
+logger = logging.getLogger(__name__)
+
+# Lower value = sent first. Pass as rate_limit_args={"priority": PRIORITY_RESULT}
+PRIORITY_RESULT = 0
+PRIORITY_NORMAL = 1
+
+# Latency samples kept for the percentiles in stats()
+LATENCY_SAMPLES = 1000
+
+# Where a chat with queued requests is scheduled
+_READY = "ready"          # its bucket has a token: on the ready heap
+_THROTTLED = "throttled"  # on the throttled heap until its bucket refills
+
+
+class _Bucket:
+    """Token bucket: rate tokens per second, holding at most capacity."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class OutboundQueue(BaseRateLimiter[Dict[str, Any]]):
+    """
+    Central queue for everything the bot sends to chats.
+
+    Plugged into the Application as its rate limiter, so every reply_text,
+    edit_text, send_document, ... goes through it without changes to the
+    handlers. Requests wait in a priority queue and are released within
+    Telegram's global limit and the per-chat limit (private chats and groups
+    differ). Each chat has its own queue; only chats whose limit allows a
+    send sit on the ready heap, keyed by their first request, so a flood to
+    one chat costs O(log n) per message instead of scanning the backlog.
+    RetryAfter from Telegram pauses sending for the requested time
+    and the request is retried instead of failing the handler. Calls that
+    don't target a chat (getUpdates, setMyCommands, ...) bypass the queue.
+    """
+
+    def __init__(self):
+        self._queues: Dict[Any, list] = {}  # chat_id -> heap of (priority, seq, future)
+        self._state: Dict[Any, str] = {}
+        self._ready = []                    # (priority, seq, chat_id) of each ready chat's head
+        self._throttled = []                # (ready_at, seq, chat_id)
+        self._sequence = itertools.count()
+        self._global = _Bucket(config.SEND_GLOBAL_PER_SECOND, config.SEND_GLOBAL_PER_SECOND)
+        self._chats: Dict[int, _Bucket] = {}
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.waits = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.sent = 0
+        self.retry_afters = 0
+
+    async def initialize(self) -> None:
+        # PTB initializes the bot (and so its rate limiter) more than once
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="outbound-queue")
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    def _chat_bucket(self, chat_id: int) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > config.SEND_MAX_TRACKED_CHATS:
+                # Buckets that have refilled completely carry no state worth keeping
+                now = time.monotonic()
+                for key, idle in list(self._chats.items()):
+                    idle.refill(now)
+                    if idle.tokens >= idle.capacity:
+                        del self._chats[key]
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = _Bucket(config.SEND_GROUP_PER_MINUTE / 60, config.SEND_CHAT_BURST)
+            else:
+                bucket = _Bucket(config.SEND_CHAT_PER_SECOND, config.SEND_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _schedule(self, chat_id, now: float):
+        """Puts a chat with queued requests on the ready heap, or the throttled heap until it may send."""
+        queue = self._queues.get(chat_id)
+        while queue and queue[0][2].cancelled():
+            heapq.heappop(queue)
+        if not queue:
+            self._queues.pop(chat_id, None)
+            return
+        wait = self._chat_bucket(chat_id).wait_time(now)
+        if wait == 0:
+            heapq.heappush(self._ready, (queue[0][0], queue[0][1], chat_id))
+            self._state[chat_id] = _READY
+        else:
+            heapq.heappush(self._throttled, (now + wait, next(self._sequence), chat_id))
+            self._state[chat_id] = _THROTTLED
+
+    def _next_chat(self, now: float):
+        """The ready chat whose first request goes next, skipping superseded heap entries."""
+        while self._ready:
+            priority, seq, chat_id = self._ready[0]
+            queue = self._queues.get(chat_id)
+            if self._state.get(chat_id) != _READY or not queue or queue[0][:2] != (priority, seq):
+                # The chat's head changed since; it has a newer entry
+                heapq.heappop(self._ready)
+            elif queue[0][2].cancelled():
+                heapq.heappop(self._ready)
+                del self._state[chat_id]
+                self._schedule(chat_id, now)
+            else:
+                return chat_id
+        return None
+
+    async def _dispatch(self):
+        """Releases queued requests, highest priority first, as the limits allow."""
+        while True:
+            now = time.monotonic()
+            while self._throttled and self._throttled[0][0] <= now:
+                chat_id = heapq.heappop(self._throttled)[2]
+                del self._state[chat_id]
+                self._schedule(chat_id, now)
+
+            chat_id = self._next_chat(now)
+            if chat_id is None:
+                self._wakeup.clear()
+                timeout = self._throttled[0][0] - now if self._throttled else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = max(self._paused_until - now, self._global.wait_time(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            heapq.heappop(self._ready)
+            future = heapq.heappop(self._queues[chat_id])[2]
+            del self._state[chat_id]
+            self._global.tokens -= 1
+            self._chat_bucket(chat_id).tokens -= 1
+            future.set_result(None)
+            self._schedule(chat_id, now)
+
+    async def _acquire(self, priority: int, seq: int, chat_id):
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, seq, future)
+        queue = self._queues.setdefault(chat_id, [])
+        heapq.heappush(queue, entry)
+        state = self._state.get(chat_id)
+        if state is None:
+            self._schedule(chat_id, time.monotonic())
+        elif state == _READY and queue[0] is entry:
+            # Jumped ahead of the chat's previous head
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+        self._wakeup.set()
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None or self._dispatcher is None:
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_NORMAL)
+        # Kept across RetryAfter retries, so the request keeps its place in its chat's queue
+        seq = next(self._sequence)
+        enqueued = time.monotonic()
+        for attempt in range(config.SEND_MAX_RETRIES + 1):
+            await self._acquire(priority, seq, chat_id)
+            if attempt == 0:
+                self.waits.append(time.monotonic() - enqueued)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_afters += 1
+                if attempt == config.SEND_MAX_RETRIES:
+                    raise
+                logger.warning(f"Flood control on {endpoint} to {chat_id}: retrying in {e.retry_after}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                continue
+            self.sent += 1
+            self.latencies.append(time.monotonic() - enqueued)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": sum(
+                1 for queue in self._queues.values() for entry in queue if not entry[2].cancelled()
+            ),
+            "sent": self.sent,
+            "retry_afters": self.retry_afters,
+            "wait_p50": percentile(self.waits, 0.50),
+            "wait_p95": percentile(self.waits, 0.95),
+            "latency_p50": percentile(self.latencies, 0.50),
+            "latency_p95": percentile(self.latencies, 0.95),
+        }
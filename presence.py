@@ -0,0 +1,119 @@
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceIndex:
+    """
+    In-memory view of the managers for routing users: who they are, when each
+    was last active, how many users each has been given and which manager
+    each user was sent to.
+
+    touch() is called for every incoming update and is a couple of dict
+    operations; changes are written to the database in batches by flush().
+    next_manager() never touches the database.
+    """
+
+    def __init__(self):
+        self._last_seen: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._dirty_seen: Dict[str, float] = {}
+        self._new_assignments: Dict[str, int] = {}
+        self._user_managers: Dict[int, str] = {}
+        self._dirty_user_managers: Dict[int, str] = {}
+
+    def load(self):
+        """Loads managers and remembered user assignments at startup."""
+        self._user_managers = db.get_manager_assignments()
+        self.refresh()
+
+    def refresh(self):
+        """Reloads the manager list, keeping changes that haven't been flushed yet."""
+        last_seen, counts = {}, {}
+        for row in db.get_manager_presence():
+            username = row["username"]
+            last_seen[username] = max(row["last_seen"] or 0.0, self._dirty_seen.get(username, 0.0))
+            counts[username] = row["assignment_count"] + self._new_assignments.get(username, 0)
+        self._last_seen, self._counts = last_seen, counts
+
+    def touch(self, username: str):
+        """Records activity by username if it belongs to a manager."""
+        if username in self._counts:
+            now = time.time()
+            self._last_seen[username] = now
+            self._dirty_seen[username] = now
+
+    def next_manager(self, user_id: int) -> Optional[str]:
+        """
+        The manager user_id should contact. Users keep their manager while it
+        is online (or while nobody is). Otherwise the least-assigned manager
+        seen within the online window is picked (most recently seen wins
+        ties), or, with nobody online, the most recently seen one. None
+        without managers.
+        """
+        if not self._counts:
+            return None
+        cutoff = time.time() - config.PRESENCE_ONLINE_WINDOW_SECONDS
+        online = [username for username, seen in self._last_seen.items() if seen >= cutoff]
+        current = self._user_managers.get(user_id)
+        if current in self._counts and (self._last_seen[current] >= cutoff or not online):
+            return current
+
+        if online:
+            manager = min(online, key=lambda username: (self._counts[username], -self._last_seen[username]))
+        else:
+            manager = max(self._counts, key=lambda username: (self._last_seen.get(username, 0.0), -self._counts[username]))
+
+        self._counts[manager] += 1
+        self._new_assignments[manager] = self._new_assignments.get(manager, 0) + 1
+        self._user_managers[user_id] = manager
+        self._dirty_user_managers[user_id] = manager
+        return manager
+
+    def flush(self):
+        """Writes pending activity and assignments to the database in one batch."""
+        if self._dirty_seen or self._new_assignments or self._dirty_user_managers:
+            db.save_manager_presence(self._dirty_seen, self._new_assignments, self._dirty_user_managers)
+            self._dirty_seen, self._new_assignments, self._dirty_user_managers = {}, {}, {}
+
+    def decay(self):
+        """Ages assignment counts so long-gone history stops dominating routing."""
+        self.flush()
+        db.decay_assignment_counts(config.PRESENCE_DECAY_FACTOR)
+        self.refresh()
+
+    def stats(self) -> Dict[str, Any]:
+        cutoff = time.time() - config.PRESENCE_ONLINE_WINDOW_SECONDS
+        return {
+            "managers": len(self._counts),
+            "online": sum(1 for seen in self._last_seen.values() if seen >= cutoff),
+        }
+
+
+async def track_presence(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before the other handlers for every update and records manager activity."""
+    user = update.effective_user
+    presence = context.bot_data.get("presence")
+    if user is not None and user.username and presence is not None:
+        presence.touch(user.username)
+
+
+async def flush_presence_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback: persist presence and pick up added/removed managers."""
+    presence = context.bot_data["presence"]
+    presence.flush()
+    presence.refresh()
+
+
+async def decay_presence_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback: decay old assignment counts."""
+    context.bot_data["presence"].decay()
+    logger.info(f"Manager assignment counts decayed by {config.PRESENCE_DECAY_FACTOR}")
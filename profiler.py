@@ -0,0 +1,61 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+# Only one profile may run at a time
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_stacks(duration: float, interval: float) -> collections.Counter:
+    """
+    Samples the stacks of every other thread (event loop, executors, keep-alive
+    server, ...) every interval seconds for duration seconds. Blocking: run it
+    in a worker thread. Returns a Counter of collapsed stacks, root first,
+    prefixed with the thread name.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        me = threading.get_ident()
+        counts = collections.Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                counts[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return counts
+    finally:
+        _running.release()
+
+
+def collapsed(counts: collections.Counter) -> str:
+    """Brendan Gregg's collapsed-stack format, readable by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def top_frames(counts: collections.Counter, limit: int = 5):
+    """The leaf frames that appear in the most samples, as (label, share) pairs."""
+    total = sum(counts.values()) or 1
+    leaves = collections.Counter()
+    for stack, count in counts.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    return [(label, count / total) for label, count in leaves.most_common(limit)]
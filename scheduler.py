@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Wait-time samples kept per manager for the percentiles in stats()
+WAIT_SAMPLES = 200
+
+
+def percentile(samples, fraction: float) -> float:
+    """Nearest-rank percentile of a sequence of numbers (0.0 when empty)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(int(fraction * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+class _Flow:
+    """Per-manager queue and accounting."""
+
+    def __init__(self, weight: float, max_in_flight: int):
+        self.weight = weight
+        self.max_in_flight = max_in_flight
+        self.queue = collections.deque()  # (finish_tag, start_tag, future, enqueued_at)
+        self.in_flight = 0
+        self.last_finish = 0.0
+        self.dispatched = 0
+        self.waits = collections.deque(maxlen=WAIT_SAMPLES)
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing of outbound 1win calls, one flow per manager.
+
+    Every request gets a virtual finish tag of max(virtual time, flow's last tag) + 1/weight
+    and requests are dispatched in tag order, so a manager with weight 2 gets
+    twice the share of one with weight 1 under contention, and a burst from one
+    manager can't starve the others. Dispatch is bounded both globally
+    (max_concurrency) and per manager (max in-flight).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        default_weight: float = 1.0,
+        default_max_in_flight: int = 2,
+        weights: Optional[Dict[str, float]] = None,
+        max_in_flight: Optional[Dict[str, int]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.default_weight = default_weight
+        self.default_max_in_flight = default_max_in_flight
+        self.weights = weights or {}
+        self.max_in_flight = max_in_flight or {}
+        self._flows: Dict[str, _Flow] = {}
+        self._in_flight = 0
+        self._virtual_time = 0.0
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            config.SCHEDULER_MAX_CONCURRENCY,
+            default_weight=config.MANAGER_DEFAULT_WEIGHT,
+            default_max_in_flight=config.MANAGER_DEFAULT_MAX_IN_FLIGHT,
+            weights=config.MANAGER_WEIGHTS,
+            max_in_flight=config.MANAGER_MAX_IN_FLIGHT,
+        )
+
+    def _flow(self, manager: str) -> _Flow:
+        flow = self._flows.get(manager)
+        if flow is None:
+            flow = _Flow(
+                self.weights.get(manager, self.default_weight),
+                self.max_in_flight.get(manager, self.default_max_in_flight),
+            )
+            self._flows[manager] = flow
+        return flow
+
+    def _dispatch(self):
+        """Starts queued requests, lowest finish tag first, while capacity allows."""
+        while self._in_flight < self.max_concurrency:
+            best = None
+            for flow in self._flows.values():
+                if flow.queue and flow.in_flight < flow.max_in_flight:
+                    if best is None or flow.queue[0][0] < best.queue[0][0]:
+                        best = flow
+            if best is None:
+                return
+
+            finish_tag, start_tag, future, enqueued_at = best.queue.popleft()
+            if future.cancelled():
+                continue
+            self._virtual_time = max(self._virtual_time, start_tag)
+            best.in_flight += 1
+            best.dispatched += 1
+            best.waits.append(time.monotonic() - enqueued_at)
+            self._in_flight += 1
+            future.set_result(None)
+
+    async def acquire(self, manager: Optional[str], waiting_since: Optional[float] = None):
+        """
+        Waits for this manager's turn and takes one upstream slot. waiting_since
+        (time.monotonic() based) is when the request started waiting, if that
+        was before it reached the scheduler; the recorded wait counts from it.
+        """
+        flow = self._flow(manager or "")
+        start_tag = max(self._virtual_time, flow.last_finish)
+        finish_tag = start_tag + 1.0 / flow.weight
+        flow.last_finish = finish_tag
+
+        future = asyncio.get_running_loop().create_future()
+        flow.queue.append((finish_tag, start_tag, future, waiting_since or time.monotonic()))
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Cancelled right after being granted a slot: hand it back
+                self.release(manager)
+            raise
+
+    def release(self, manager: Optional[str]):
+        """Returns a slot taken by acquire() and starts the next request."""
+        flow = self._flows[manager or ""]
+        flow.in_flight -= 1
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, manager: Optional[str]):
+        await self.acquire(manager)
+        try:
+            yield
+        finally:
+            self.release(manager)
+
+    def stats(self) -> Dict[str, Any]:
+        managers = {}
+        for manager, flow in self._flows.items():
+            managers[manager] = {
+                "queued": sum(1 for entry in flow.queue if not entry[2].cancelled()),
+                "in_flight": flow.in_flight,
+                "dispatched": flow.dispatched,
+                "weight": flow.weight,
+                "wait_p50": percentile(flow.waits, 0.50),
+                "wait_p95": percentile(flow.waits, 0.95),
+            }
+        return {
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "managers": managers,
+        }
@@ -0,0 +1,192 @@
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# The trace and span active in the current task (contextvars follow awaits)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Spans are handed to a background thread which writes them to a rotating file
+_export_queue = queue.SimpleQueue()
+_listener = None
+
+# Hard cap so a runaway loop inside one update can't hold unbounded memory
+MAX_SPANS_PER_TRACE = 256
+
+
+class _JSONLineFormatter(logging.Formatter):
+    """Serializes a span dict carried in record.msg as a single JSON line."""
+
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+class Trace:
+    """All spans recorded while handling one update."""
+
+    def __init__(self, trace_id: Optional[str] = None, sampled: Optional[bool] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        if sampled is None:
+            # Decided by the id, so every part of one trace (e.g. the handler
+            # and the job worker continuing it) is kept or dropped together
+            sampled = int(self.trace_id[:8], 16) / 2 ** 32 < config.TRACE_SAMPLE_RATE
+        self.sampled = sampled
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, span: Dict[str, Any]):
+        if len(self.spans) < MAX_SPANS_PER_TRACE:
+            self.spans.append(span)
+
+
+def enabled() -> bool:
+    return _listener is not None
+
+
+def setup():
+    """Starts the background exporter if tracing is configured."""
+    global _listener
+    if _listener is not None:
+        return
+    if config.TRACE_SAMPLE_RATE <= 0 and config.TRACE_SLOW_MS <= 0:
+        logger.info("Tracing disabled")
+        return
+
+    handler = logging.handlers.RotatingFileHandler(
+        config.TRACE_FILE,
+        maxBytes=config.TRACE_MAX_BYTES,
+        backupCount=config.TRACE_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    handler.setFormatter(_JSONLineFormatter())
+    _listener = logging.handlers.QueueListener(_export_queue, handler)
+    _listener.start()
+    logger.info(
+        f"Tracing to {config.TRACE_FILE} (sample rate {config.TRACE_SAMPLE_RATE}, "
+        f"slow threshold {config.TRACE_SLOW_MS} ms)"
+    )
+
+
+def shutdown():
+    """Flushes pending spans and stops the exporter thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+def _export(trace: Trace, root: Dict[str, Any]):
+    """Tail-based sampling: keep sampled traces plus every slow one."""
+    slow = config.TRACE_SLOW_MS > 0 and root["duration_ms"] >= config.TRACE_SLOW_MS
+    if not (trace.sampled or slow):
+        return
+    for span in trace.spans:
+        _export_queue.put_nowait(logging.makeLogRecord({"msg": span}))
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Records a timed span under the current trace. A no-op outside a trace."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    record = {
+        "trace_id": trace.trace_id,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": _current_span.get(),
+        "name": name,
+        "start": time.time(),
+        "attrs": attrs,
+    }
+    token = _current_span.set(record["span_id"])
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = repr(e)
+        raise
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        _current_span.reset(token)
+        trace.add(record)
+
+
+@contextmanager
+def trace(name: str, trace_id: Optional[str] = None, **attrs):
+    """
+    Opens a root span and makes it the current trace. Passing trace_id
+    continues an existing trace, e.g. when work is handed off to a worker.
+    """
+    if not enabled():
+        yield None
+        return
+
+    current = Trace(trace_id=trace_id)
+    token = _current_trace.set(current)
+    try:
+        with span(name, **attrs) as root:
+            yield root
+    finally:
+        _current_trace.reset(token)
+        _export(current, root)
+
+
+def _record_receive(update, received_at: float):
+    """Adds a span covering the time between the message being sent and us handling it."""
+    message = getattr(update, "effective_message", None)
+    if message is None or message.date is None:
+        return
+    sent_at = message.date.timestamp()
+    current = _current_trace.get()
+    current.add({
+        "trace_id": current.trace_id,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": _current_span.get(),
+        "name": "telegram.receive",
+        "start": sent_at,
+        "duration_ms": round(max(received_at - sent_at, 0) * 1000, 3),
+        "attrs": {},
+    })
+
+
+def traced(handler_name: Optional[str] = None):
+    """Decorator for bot handlers: one trace per update, rooted at the handler."""
+
+    def decorator(func):
+        name = handler_name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            received_at = time.time()
+            user = getattr(update, "effective_user", None)
+            with trace(
+                f"handler.{name}",
+                update_id=getattr(update, "update_id", None),
+                user_id=user.id if user else None,
+            ) as root:
+                if root is not None:
+                    _record_receive(update, received_at)
+                return await func(update, context, *args, **kwargs)
+
+        return wrapper
+
+    return decorator